@@ -6,7 +6,7 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[('README.md', '.')],
-    hiddenimports=['pyzbar', 'cv2', 'qrcode', 'PIL'],
+    hiddenimports=['pyzbar', 'cv2', 'qrcode', 'PIL', 'qr_engine'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
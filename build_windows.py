@@ -42,6 +42,7 @@ def build_executable():
         '--hidden-import=cv2',          # 確保包含 opencv
         '--hidden-import=qrcode',       # 確保包含 qrcode
         '--hidden-import=PIL',          # 確保包含 Pillow
+        '--hidden-import=qr_engine',    # 偵測與生成引擎
         'qrcode_converter.py'
     ]
     
@@ -92,6 +93,8 @@ def create_release_package():
     # 複製程式碼檔案（作為備份）
     shutil.copy('qrcode_converter.py', release_folder / 'qrcode_converter.py')
     print("✓ 已複製: qrcode_converter.py")
+    shutil.copy('qr_engine.py', release_folder / 'qr_engine.py')
+    print("✓ 已複製: qr_engine.py")
     
     # 複製 requirements.txt
     shutil.copy('requirements.txt', release_folder / 'requirements.txt')
@@ -25,6 +25,8 @@ def create_windows_arm_package():
     # 複製程式檔案
     shutil.copy('qrcode_converter.py', release_folder / 'qrcode_converter.py')
     print("✓ 已複製: qrcode_converter.py")
+    shutil.copy('qr_engine.py', release_folder / 'qr_engine.py')
+    print("✓ 已複製: qr_engine.py")
     
     # 複製 requirements.txt（移除 pyinstaller）
     with open('requirements.txt', 'r') as f:
@@ -146,6 +148,7 @@ pip install -r requirements.txt
 ```
 release-windows-arm/
 ├── qrcode_converter.py          # 主程式
+├── qr_engine.py                  # 偵測與生成引擎
 ├── run.bat                       # 執行程式（雙擊）
 ├── install.bat                   # 安裝套件（雙擊）
 ├── requirements.txt              # Python 套件清單
@@ -4,22 +4,15 @@
 建立測試用的 QR code 圖片
 """
 
-import qrcode
 from PIL import Image
 from pathlib import Path
 
+from qr_engine import QRCodeEncoder, generate_qrcode_image, render_qrcode_image
+
 
 def create_single_qrcode(content: str, filename: str):
-    """建立單個 QR code"""
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_H,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(content)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
+    """建立單個 QR code（與轉換程式輸出相同的編碼方式）"""
+    img = generate_qrcode_image(content)
     
     output_path = Path("input") / filename
     img.save(str(output_path))
@@ -28,19 +21,9 @@ def create_single_qrcode(content: str, filename: str):
 
 def create_multiple_qrcodes_image(contents: list[str], filename: str):
     """建立包含多個 QR code 的圖片"""
-    # 為每個內容建立 QR code
-    qr_images = []
-    for content in contents:
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_H,
-            box_size=8,
-            border=2,
-        )
-        qr.add_data(content)
-        qr.make(fit=True)
-        img = qr.make_image(fill_color="black", back_color="white")
-        qr_images.append(img)
+    # 為每個內容建立 QR code（較小的格子與邊框）
+    encoder = QRCodeEncoder(box_size=8, border=2)
+    qr_images = [render_qrcode_image(encoder.make(content)) for content in contents]
     
     # 計算組合圖片的大小
     qr_width = qr_images[0].size[0]
@@ -29,6 +29,7 @@ def create_universal_package():
     # 複製核心檔案
     files_to_copy = {
         'qrcode_converter.py': '主程式',
+        'qr_engine.py': '偵測與生成引擎',
         'requirements.txt': '套件清單',
     }
     
@@ -241,6 +242,7 @@ python3 qrcode_converter.py
 ```
 QRCodeConverter/
 ├── qrcode_converter.py    # 主程式（跨平台）
+├── qr_engine.py           # 偵測與生成引擎
 ├── requirements.txt       # Python 套件清單
 │
 ├── install.bat            # Windows 安裝腳本
@@ -25,6 +25,8 @@ def create_portable_package():
     # 複製主程式
     shutil.copy('qrcode_converter.py', release_folder / 'qrcode_converter.py')
     print("✓ 已複製: qrcode_converter.py")
+    shutil.copy('qr_engine.py', release_folder / 'qr_engine.py')
+    print("✓ 已複製: qr_engine.py")
     
     # 複製 requirements.txt
     shutil.copy('requirements.txt', release_folder / 'requirements.txt')
@@ -47,6 +49,7 @@ def create_portable_package():
     print(f"\n✅ Windows 可攜版本已建立在: {release_folder.absolute()}")
     print("\n📦 包含檔案：")
     print("   • qrcode_converter.py - 主程式")
+    print("   • qr_engine.py - 偵測與生成引擎")
     print("   • install.bat - 安裝套件（第一次使用時執行）")
     print("   • run.bat - 執行程式")
     print("   • requirements.txt - 套件清單")
@@ -219,6 +222,7 @@ windows_portable/
 ├── install.bat          # 第一次使用時執行（安裝套件）
 ├── run.bat              # 執行程式（每次使用）
 ├── qrcode_converter.py  # 主程式
+├── qr_engine.py         # 偵測與生成引擎
 ├── requirements.txt     # 套件清單
 ├── 使用說明.txt         # 本檔案
 ├── input/               # 放置原始 QR code 圖片
@@ -0,0 +1,1475 @@
+# -*- coding: utf-8 -*-
+"""
+QR Code 偵測與生成引擎
+命令列版本（qrcode_converter.py）、網頁版本（web_app.py）與測試圖片產生器共用，
+包含執行環境設定、圖片前處理、偵測流程與 QR code 編碼
+"""
+
+import io
+import os
+import json
+import math
+import time
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import qrcode
+from pathlib import Path
+from PIL import Image
+try:
+    from pyzbar.pyzbar import decode
+    PYZBAR_AVAILABLE = True
+except ImportError:
+    PYZBAR_AVAILABLE = False
+    print("⚠️  pyzbar 未安裝，將使用 OpenCV 偵測器（可能較不準確）")
+    print("   建議安裝: pip3 install pyzbar")
+
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+
+
+def _read_cgroup_file(path: Path) -> str | None:
+    """讀取 cgroup 設定檔，不存在或無法讀取時返回 None"""
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_v2_dirs() -> list[Path]:
+    """取得目前行程所屬的 cgroup v2 目錄（由內而外，含根目錄）"""
+    dirs = []
+    content = _read_cgroup_file(Path("/proc/self/cgroup")) or ""
+    for line in content.splitlines():
+        if line.startswith("0::"):
+            relative = Path(line[3:].strip().lstrip("/"))
+            while relative.parts:
+                dirs.append(CGROUP_ROOT / relative)
+                relative = relative.parent
+    dirs.append(CGROUP_ROOT)
+    return dirs
+
+
+def read_cgroup_cpu_limit() -> float | None:
+    """
+    讀取 cgroup 的 CPU 配額（例如 k8s 的 cpu: 500m 會得到 0.5）
+    
+    依序檢查 cgroup v2 的 cpu.max 與 cgroup v1 的 cpu.cfs_quota_us / cpu.cfs_period_us。
+    cgroup v2 的配額可能設在任何一層上層（例如 pod 層有配額、容器層為 max），
+    因此檢查整條路徑並取最小的配額。
+    
+    Returns:
+        可使用的 CPU 數量（可能為小數），沒有限制時返回 None
+    """
+    # cgroup v2: "<quota> <period>" 或 "max <period>"
+    limits = []
+    found_v2 = False
+    for cgroup_dir in _cgroup_v2_dirs():
+        content = _read_cgroup_file(cgroup_dir / "cpu.max")
+        if content is None:
+            continue
+        found_v2 = True
+        fields = content.split()
+        if len(fields) == 2 and fields[0] != "max":
+            try:
+                quota, period = int(fields[0]), int(fields[1])
+            except ValueError:
+                continue
+            if quota > 0 and period > 0:
+                limits.append(quota / period)
+    if found_v2:
+        return min(limits, default=None)
+    
+    # cgroup v1: quota 為 -1 表示沒有限制
+    for cpu_dir in (CGROUP_ROOT / "cpu", CGROUP_ROOT / "cpu,cpuacct"):
+        quota = _read_cgroup_file(cpu_dir / "cpu.cfs_quota_us")
+        period = _read_cgroup_file(cpu_dir / "cpu.cfs_period_us")
+        if quota is None or period is None:
+            continue
+        try:
+            quota, period = int(quota), int(period)
+        except ValueError:
+            return None
+        if quota > 0 and period > 0:
+            return quota / period
+        return None
+    
+    return None
+
+
+def available_cpu_count() -> int:
+    """取得實際可用的 CPU 數量（考慮 CPU affinity 與 cgroup 配額，至少為 1）"""
+    return _cpu_count_within(read_cgroup_cpu_limit())
+
+
+def _cpu_count_within(cpu_limit: float | None) -> int:
+    """依已讀取的 cgroup 配額（None 表示沒有限制）計算可用的 CPU 數量"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    
+    if cpu_limit is not None:
+        # 配額不足一顆 CPU 時仍使用 1 個，避免超額使用造成 throttling
+        cpus = min(cpus, max(1, math.floor(cpu_limit)))
+    return max(1, cpus)
+
+
+def configure_runtime(workers: int = 0, threads: int = 1) -> dict:
+    """
+    依可用 CPU 決定 worker 數量，並設定 OpenCV 內部執行緒數量
+    
+    行程數量 × 每個 worker 的執行緒數量 × OpenCV 執行緒數量不會超過可用 CPU，
+    避免多層平行化互相放大造成超額使用。
+    
+    Args:
+        workers: 指定的 worker 數量，0 表示依可用 CPU 自動決定
+        threads: 每個 worker 內平行處理的執行緒數量（例如分塊偵測），
+            0 表示使用 worker 分到的全部 CPU（此時 OpenCV 只用 1 個執行緒）
+        
+    Returns:
+        實際使用的設定：cpu_limit、cpus、workers、threads、opencv_threads
+    """
+    cpu_limit = read_cgroup_cpu_limit()
+    cpus = _cpu_count_within(cpu_limit)
+    workers = workers if workers > 0 else cpus
+    threads = threads if threads > 0 else max(1, cpus // workers)
+    opencv_threads = max(1, cpus // (workers * threads))
+    cv2.setNumThreads(opencv_threads)
+    return {
+        'cpu_limit': cpu_limit,
+        'cpus': cpus,
+        'workers': workers,
+        'threads': threads,
+        'opencv_threads': opencv_threads,
+    }
+
+
+def format_runtime(runtime: dict) -> str:
+    """將執行環境設定轉為顯示用文字"""
+    cpu_limit = runtime['cpu_limit']
+    limit_text = f"{cpu_limit:g}" if cpu_limit is not None else "無限制"
+    return (
+        f"CPU 配額: {limit_text}｜可用 CPU: {runtime['cpus']}｜"
+        f"行程數: {runtime['workers']}｜"
+        + (f"分塊執行緒: {runtime['threads']}｜" if runtime.get('threads', 1) > 1 else "")
+        + f"OpenCV 執行緒: {runtime['opencv_threads']}"
+    )
+
+
+def render_qrcode_image(qr: qrcode.QRCode) -> Image.Image:
+    """
+    將 QR code 的模組矩陣直接放大成 1-bit 圖片
+    
+    以 NumPy 一次放大整個矩陣，不經過 PIL 逐格繪製，
+    結果與 qr.make_image(fill_color="black", back_color="white") 逐像素相同。
+    
+    Args:
+        qr: 已呼叫 make() 的 QRCode 物件（矩陣已包含邊框）
+        
+    Returns:
+        黑白（mode "1"）的 PIL 圖片
+    """
+    modules = np.array(qr.get_matrix(), dtype=bool)
+    # mode "1" 中 False 為黑色，深色模組需反轉
+    pixels = np.repeat(np.repeat(~modules, qr.box_size, axis=0), qr.box_size, axis=1)
+    return Image.fromarray(pixels)
+
+
+# QR code 編碼設定檔：固定版本、容錯等級與遮罩，可省去版本搜尋與 8 種遮罩的評分
+ENCODING_PROFILES = {
+    'auto': {
+        'description': "自動選擇版本與最佳遮罩（最慢，與舊版輸出相同）",
+        'version': None,
+        'error_correction': qrcode.constants.ERROR_CORRECT_H,
+        'mask_pattern': None,
+    },
+    'mycard': {
+        # [MyCard]|<12 字元>|<12 字元> 共 34 bytes，剛好是版本 4、容錯 H 的容量
+        'description': "固定版本 4、容錯 H、遮罩 1（適用 [MyCard] 卡號格式）",
+        'version': 4,
+        'error_correction': qrcode.constants.ERROR_CORRECT_H,
+        'mask_pattern': 1,
+    },
+    'learned': {
+        'description': "第一個 QR code 自動選擇後，之後（同一個 worker）都沿用相同的版本與遮罩",
+        'version': None,
+        'error_correction': qrcode.constants.ERROR_CORRECT_H,
+        'mask_pattern': None,
+        'learn': True,
+    },
+}
+
+
+class QRCodeEncoder:
+    """
+    依編碼設定檔建立 QR code
+    
+    固定版本的內容放不下時，會改為自動選擇版本（仍沿用設定的遮罩）。
+    """
+    
+    def __init__(self, profile: str = "auto", box_size: int = 10, border: int = 4):
+        """
+        Args:
+            profile: ENCODING_PROFILES 中的設定檔名稱
+            box_size: 每個格子的像素大小
+            border: 邊框寬度（格子數）
+        """
+        if profile not in ENCODING_PROFILES:
+            raise ValueError(f"未知的編碼設定檔: {profile}（可用: {', '.join(ENCODING_PROFILES)}）")
+        self.profile = profile
+        self.box_size = box_size
+        self.border = border
+        settings = ENCODING_PROFILES[profile]
+        self.version = settings['version']
+        self.error_correction = settings['error_correction']
+        self.mask_pattern = settings['mask_pattern']
+        self.learn = settings.get('learn', False)
+    
+    def _new_qrcode(self, version: int | None) -> qrcode.QRCode:
+        return qrcode.QRCode(
+            version=version,  # 控制 QR code 的大小 (1-40)
+            error_correction=self.error_correction,
+            box_size=self.box_size,
+            border=self.border,
+            mask_pattern=self.mask_pattern,
+        )
+    
+    def make(self, content: str) -> qrcode.QRCode:
+        """
+        建立 QR code
+        
+        Args:
+            content: QR code 內容
+            
+        Returns:
+            已完成編碼（make）的 QRCode 物件
+        """
+        if self.version is not None:
+            qr = self._new_qrcode(self.version)
+            qr.add_data(content)
+            try:
+                qr.make(fit=False)
+                return qr
+            except qrcode.exceptions.DataOverflowError:
+                pass  # 超過固定版本的容量，改為自動選擇版本
+        
+        qr = self._new_qrcode(1)
+        qr.add_data(content)
+        
+        if self.learn and self.version is None:
+            # 選出版本與最佳遮罩後記下來，之後的 QR code 直接沿用
+            qr.best_fit(start=1)
+            self.version = qr.version
+            if self.mask_pattern is None:
+                self.mask_pattern = qr.best_mask_pattern()
+            qr.mask_pattern = self.mask_pattern
+            qr.make(fit=False)
+            return qr
+        
+        qr.make(fit=True)
+        return qr
+
+
+# 每個執行緒（worker）各自保留一份可重複使用的 OpenCV 物件
+_worker_state = threading.local()
+
+
+def get_clahe(clip_limit: float = 2.0, tile_grid_size: int = 8):
+    """取得目前 worker 共用的 CLAHE 物件（對比度限制自適應直方圖均衡化）"""
+    clahes = getattr(_worker_state, 'clahes', None)
+    if clahes is None:
+        clahes = _worker_state.clahes = {}
+    key = (clip_limit, tile_grid_size)
+    if key not in clahes:
+        clahes[key] = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=(tile_grid_size, tile_grid_size))
+    return clahes[key]
+
+
+def get_qrcode_detector():
+    """取得目前 worker 共用的 OpenCV QRCodeDetector"""
+    detector = getattr(_worker_state, 'qrcode_detector', None)
+    if detector is None:
+        detector = cv2.QRCodeDetector()
+        _worker_state.qrcode_detector = detector
+    return detector
+
+
+def get_aruco_qrcode_detector():
+    """
+    取得目前 worker 共用的 OpenCV QRCodeDetectorAruco（OpenCV 4.8 以上才有，否則返回 None）
+    
+    以不同方式定位 finder pattern，可解出部分標準偵測器失敗的 QR code。
+    """
+    if not hasattr(cv2, 'QRCodeDetectorAruco'):
+        return None
+    detector = getattr(_worker_state, 'aruco_qrcode_detector', None)
+    if detector is None:
+        detector = cv2.QRCodeDetectorAruco()
+        _worker_state.aruco_qrcode_detector = detector
+    return detector
+
+
+def get_qrcode_encoder(profile: str = "auto") -> QRCodeEncoder:
+    """取得目前 worker 共用的 QR code 編碼器（learned 設定檔學到的參數會跨圖片沿用）"""
+    encoders = getattr(_worker_state, 'qrcode_encoders', None)
+    if encoders is None:
+        encoders = _worker_state.qrcode_encoders = {}
+    if profile not in encoders:
+        encoders[profile] = QRCodeEncoder(profile)
+    return encoders[profile]
+
+
+# 金字塔解碼的縮小比例，以及縮小後最長邊的下限（再小 QR code 的模組會糊掉）
+PYRAMID_SCALES = (0.25, 0.5)
+PYRAMID_MIN_SIDE = 600
+# 成功率估計低於此值的比例暫時略過（連續失敗 3 次後略過）
+PYRAMID_MIN_SCORE = 0.25
+# 被略過的比例每經過這麼多張圖片重新嘗試一次，圖片的性質改變時可以恢復使用
+PYRAMID_EXPLORE_INTERVAL = 20
+
+
+def get_scale_stats() -> dict:
+    """取得目前 worker 的金字塔比例統計（比例 → [有找到 QR code 的次數, 嘗試次數, 連續略過次數]）"""
+    stats = getattr(_worker_state, 'scale_stats', None)
+    if stats is None:
+        stats = _worker_state.scale_stats = {}
+    return stats
+
+
+def pyramid_levels(image_shape, stats: dict) -> list[float]:
+    """
+    依圖片尺寸決定要嘗試的縮小比例，並依過去的成功率排序
+    
+    成功率過低的比例暫時略過（記入 stats 的連續略過次數），
+    連續略過 PYRAMID_EXPLORE_INTERVAL 張圖片後排在最前面重新嘗試一次。
+    
+    Args:
+        image_shape: 原圖的 shape
+        stats: 比例 → [有找到 QR code 的次數, 嘗試次數, 連續略過次數]（見 get_scale_stats）
+        
+    Returns:
+        由先到後嘗試的縮小比例列表（不含原尺寸）
+    """
+    def score(scale):
+        succeeded, attempted, _ = stats.get(scale, (0, 0, 0))
+        return (succeeded + 1) / (attempted + 2)
+    
+    long_side = max(image_shape[:2])
+    levels = []
+    exploring = set()
+    for scale in PYRAMID_SCALES:
+        if long_side * scale < PYRAMID_MIN_SIDE:
+            continue
+        if score(scale) < PYRAMID_MIN_SCORE:
+            entry = stats[scale]
+            entry[2] += 1
+            if entry[2] <= PYRAMID_EXPLORE_INTERVAL:
+                continue
+            exploring.add(scale)
+        levels.append(scale)
+    # 重新嘗試的比例最先執行（否則其他比例找齊後仍不會執行到）；
+    # 其餘成功率高的優先，相同時由小到大，先試像素最少的比例
+    return sorted(levels, key=lambda scale: (scale not in exploring, -score(scale), scale))
+
+
+# libjpeg 可在解碼時直接縮小的比例（其他格式由 OpenCV 解碼後縮小）
+REDUCED_GRAYSCALE_FLAGS = {
+    0.5: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    0.25: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    0.125: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+class PreprocessContext:
+    """
+    單張圖片的前處理快取
+    
+    灰階、CLAHE 增強與二值化圖片都在第一次使用時才計算，且只計算一次，
+    讓同一張圖片的各種偵測方法共用同一份結果。
+    以 from_bytes 建立時，原圖也在第一次使用時才解碼：灰階圖直接以灰階解碼，
+    只有需要彩色原圖的偵測方法才會做完整的彩色解碼。
+    """
+    
+    def __init__(self, image, color_order: str = "BGR"):
+        """
+        Args:
+            image: 原始圖片（uint8 的 numpy array，灰階或 1、3、4 個通道的彩色圖）
+            color_order: 彩色圖片的通道順序，cv2.imread 為 "BGR"，PIL 為 "RGB"
+            
+        Raises:
+            ValueError: 不支援的資料型別或通道數量
+        """
+        if image is not None:
+            if image.dtype != np.uint8:
+                raise ValueError(f"不支援的圖片資料型別: {image.dtype}")
+            if not (image.ndim == 2 or (image.ndim == 3 and image.shape[2] in (1, 3, 4))):
+                raise ValueError(f"不支援的圖片形狀: {image.shape}")
+        self._image = image
+        self.image_bytes = None
+        self.color_order = color_order
+        self._cache = {}
+    
+    @classmethod
+    def from_bytes(cls, image_bytes: bytes) -> "PreprocessContext":
+        """
+        由圖片檔案內容建立，圖片延後到需要時才解碼
+        
+        Args:
+            image_bytes: 圖片檔案的內容（JPEG、PNG 等）
+        """
+        context = cls(None)
+        context.image_bytes = image_bytes
+        return context
+    
+    def _decode(self, flags: int):
+        """以指定的 imdecode 旗標解碼圖片檔案內容，內容為空或解碼失敗時拋出 ValueError"""
+        if not self.image_bytes:
+            raise ValueError("圖片內容是空的")
+        image = cv2.imdecode(np.frombuffer(self.image_bytes, dtype=np.uint8), flags)
+        if image is None:
+            raise ValueError("無法解碼圖片")
+        return image
+    
+    def _get(self, name: str, compute):
+        """取得快取的衍生圖片，不存在時才計算"""
+        if name not in self._cache:
+            self._cache[name] = compute()
+        return self._cache[name]
+    
+    @property
+    def image(self):
+        """原始圖片（延後解碼時為完整尺寸的 BGR 彩色圖）"""
+        if self._image is None:
+            self._image = self._decode(cv2.IMREAD_COLOR)
+        return self._image
+    
+    @property
+    def shape(self) -> tuple[int, int]:
+        """圖片的 (高, 寬)，盡量不解碼整張圖片"""
+        if self._image is not None:
+            return self._image.shape[:2]
+        if 'gray' in self._cache:
+            return self._cache['gray'].shape[:2]
+        try:
+            # 只讀取檔頭；EXIF 旋轉會交換寬高，這裡的用途只看最長邊
+            width, height = Image.open(io.BytesIO(self.image_bytes)).size
+            return height, width
+        except Exception:
+            return self.gray.shape[:2]
+    
+    def reduced(self, scale: float) -> "PreprocessContext":
+        """
+        取得縮小後的灰階圖前處理快取
+        
+        延後解碼且比例為 1/2、1/4、1/8 時，由 libjpeg 在解碼時直接縮小，
+        不必先解出完整尺寸的圖片。
+        
+        Args:
+            scale: 縮小比例
+        """
+        def compute():
+            if self._image is None and 'gray' not in self._cache and scale in REDUCED_GRAYSCALE_FLAGS:
+                small = self._decode(REDUCED_GRAYSCALE_FLAGS[scale])
+            else:
+                small = cv2.resize(self.gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            return PreprocessContext(small)
+        return self._get(('reduced', scale), compute)
+    
+    def _compute_gray(self):
+        if self._image is None:
+            return self._decode(cv2.IMREAD_GRAYSCALE)
+        if self.image.ndim == 2:
+            return self.image
+        channels = self.image.shape[2]
+        if channels == 1:
+            return self.image[:, :, 0]
+        if self.color_order == "RGB":
+            code = cv2.COLOR_RGBA2GRAY if channels == 4 else cv2.COLOR_RGB2GRAY
+        else:
+            code = cv2.COLOR_BGRA2GRAY if channels == 4 else cv2.COLOR_BGR2GRAY
+        return cv2.cvtColor(self.image, code)
+    
+    def _compute_bgr(self):
+        if self.image.ndim == 2 or self.image.shape[2] == 1:
+            return self.image
+        channels = self.image.shape[2]
+        if self.color_order == "RGB":
+            code = cv2.COLOR_RGBA2BGR if channels == 4 else cv2.COLOR_RGB2BGR
+            return cv2.cvtColor(self.image, code)
+        if channels == 4:
+            return cv2.cvtColor(self.image, cv2.COLOR_BGRA2BGR)
+        return self.image
+    
+    def _compute_binary(self):
+        _, binary = cv2.threshold(self.gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return binary
+    
+    @property
+    def gray(self):
+        """灰階圖"""
+        return self._get('gray', self._compute_gray)
+    
+    @property
+    def bgr(self):
+        """OpenCV 使用的 BGR 圖（灰階圖片維持灰階）"""
+        return self._get('bgr', self._compute_bgr)
+    
+    @property
+    def enhanced(self):
+        """CLAHE 增強對比度後的灰階圖"""
+        return self._get('enhanced', lambda: get_clahe().apply(self.gray))
+    
+    @property
+    def binary(self):
+        """Otsu 二值化圖"""
+        return self._get('binary', self._compute_binary)
+
+
+def locate_qrcode_regions(gray, max_side: int = 1000, padding: float = 0.25) -> list[tuple[int, int, int, int]]:
+    """
+    在縮小的灰階圖上快速定位 QR code 候選區域（只偵測位置，不解碼）
+    
+    Args:
+        gray: 原尺寸灰階圖
+        max_side: 縮小後的最長邊（像素）
+        padding: 每個區域向外擴張的比例（相對於 QR code 邊長）
+        
+    Returns:
+        原圖座標的區域列表 (x0, y0, x1, y1)
+    """
+    height, width = gray.shape[:2]
+    scale = min(1.0, max_side / max(height, width))
+    small = gray if scale == 1.0 else cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    
+    found, points = get_qrcode_detector().detectMulti(small)
+    if not found or points is None:
+        return []
+    
+    regions = []
+    for quad in points.reshape(-1, 4, 2) / scale:
+        x0, y0 = quad.min(axis=0)
+        x1, y1 = quad.max(axis=0)
+        pad = max(x1 - x0, y1 - y0) * padding
+        regions.append((
+            max(0, int(x0 - pad)), max(0, int(y0 - pad)),
+            min(width, int(x1 + pad) + 1), min(height, int(y1 + pad) + 1),
+        ))
+    return regions
+
+
+# 分塊模式中相鄰區塊最少重疊的比例（相對於區塊邊長）；
+# 實際重疊另依定位到的 QR code 大小放大，見 tile_layout
+TILE_OVERLAP = 0.25
+
+# 分塊前估計 QR code 大小時依序嘗試的縮小圖最長邊（像素），定位到就停止
+TILE_LOCATE_SIDES = (1000, 2000)
+
+
+def tile_boxes(image_shape, tile_size: int, overlap: float = TILE_OVERLAP,
+               min_overlap: int = 0) -> list[tuple[int, int, int, int]]:
+    """
+    將圖片切成互相重疊的區塊，由上而下、由左而右排列
+    
+    相鄰區塊至少重疊 max(tile_size × overlap, min_overlap) 像素，
+    邊長不超過重疊寬度的 QR code 即使落在接縫上，也至少會完整出現在其中一塊。
+    
+    Args:
+        image_shape: 圖片的 shape
+        tile_size: 區塊邊長（像素）
+        overlap: 重疊比例
+        min_overlap: 最少重疊的像素數（需小於 tile_size）
+        
+    Returns:
+        區塊列表 (x0, y0, x1, y1)
+    """
+    height, width = image_shape[:2]
+    overlap_pixels = max(int(tile_size * overlap), min_overlap)
+    step = max(1, tile_size - overlap_pixels)
+    
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, step))
+        positions.append(length - tile_size)  # 最後一塊貼齊邊緣
+        return positions
+    
+    return [
+        (x0, y0, min(width, x0 + tile_size), min(height, y0 + tile_size))
+        for y0 in starts(height)
+        for x0 in starts(width)
+    ]
+
+
+def tile_layout(gray, tile_size: int) -> tuple[int, int]:
+    """
+    依縮小圖上定位到的 QR code 大小決定分塊的區塊邊長與重疊寬度
+    
+    重疊寬度至少為最大候選區域的邊長（含外擴的邊界），落在接縫上的 QR code
+    才會完整出現在某一塊；QR code 大到區塊放不下重疊時，區塊邊長放大為重疊的兩倍。
+    縮小圖依 TILE_LOCATE_SIDES 由小到大嘗試，定位不到任何區域時使用 TILE_OVERLAP 的比例。
+    
+    Args:
+        gray: 原尺寸灰階圖
+        tile_size: 設定的區塊邊長（像素）
+        
+    Returns:
+        (區塊邊長, 最少重疊的像素數)
+    """
+    regions = []
+    for max_side in TILE_LOCATE_SIDES:
+        regions = locate_qrcode_regions(gray, max_side=max_side)
+        if regions or max_side >= max(gray.shape[:2]):
+            break
+    code_size = max((max(x1 - x0, y1 - y0) for x0, y0, x1, y1 in regions), default=0)
+    overlap = max(int(tile_size * TILE_OVERLAP), code_size)
+    return max(tile_size, overlap * 2), overlap
+
+
+def polygon_geometry(polygon: list) -> tuple[np.ndarray, float, float]:
+    """
+    計算 QR code 四邊形的中心、邊長與旋轉角度
+    
+    Returns:
+        (中心點, 平均邊長, 旋轉角度（度）) 的元組
+    """
+    (cx, cy), (width, height), angle = cv2.minAreaRect(np.array(polygon, dtype=np.float32))
+    return np.array([cx, cy]), (width + height) / 2, angle
+
+
+# 兩個 QR code 的外框重疊比例（IoU）超過此值即視為同一個 QR code
+DUPLICATE_IOU = 0.5
+
+
+def polygon_bounds(polygon: list) -> tuple[float, float, float, float]:
+    """計算四邊形的外框 (x0, y0, x1, y1)"""
+    points = np.asarray(polygon, dtype=np.float32).reshape(-1, 2)
+    x0, y0 = points.min(axis=0)
+    x1, y1 = points.max(axis=0)
+    return float(x0), float(y0), float(x1), float(y1)
+
+
+def bounds_iou(a: tuple, b: tuple) -> float:
+    """計算兩個外框的交集除以聯集（IoU）"""
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def add_detection(detected_qrcodes: list[dict], data: str, method: str, polygon: list) -> bool:
+    """
+    加入一筆偵測結果，內容相同或位置與已有的 QR code 重疊時視為重複
+    
+    同一個 QR code 在不同方法下可能被誤讀成不同內容，以位置去重可避免多產生一個輸出。
+    
+    Args:
+        detected_qrcodes: 已偵測到的結果列表（data、method、polygon）
+        data: QR code 內容
+        method: 偵測方法名稱
+        polygon: 原圖座標的四邊形頂點
+        
+    Returns:
+        是否為新的 QR code（已加入列表）
+    """
+    if not data:
+        return False
+    bounds = polygon_bounds(polygon) if polygon else None
+    for existing in detected_qrcodes:
+        if existing['data'] == data:
+            return False
+        if bounds and existing['polygon'] \
+                and bounds_iou(bounds, polygon_bounds(existing['polygon'])) > DUPLICATE_IOU:
+            return False
+    detected_qrcodes.append({'data': data, 'method': method, 'polygon': polygon})
+    return True
+
+
+def sort_reading_order(detected_qrcodes: list[dict]) -> list[dict]:
+    """
+    依閱讀順序排列偵測結果：先由上而下分行，同一行再由左而右
+    
+    中心點的垂直距離小於 QR code 高度一半的視為同一行，
+    讓輸出檔名的編號與偵測方法、偵測順序無關。沒有位置的結果排在最後。
+    
+    Returns:
+        排序後的新列表
+    """
+    located = [qr for qr in detected_qrcodes if qr['polygon']]
+    unlocated = [qr for qr in detected_qrcodes if not qr['polygon']]
+    if not located:
+        return unlocated
+    
+    bounds = {id(qr): polygon_bounds(qr['polygon']) for qr in located}
+    def center(qr):
+        x0, y0, x1, y1 = bounds[id(qr)]
+        return (x0 + x1) / 2, (y0 + y1) / 2
+    tolerance = float(np.median([b[3] - b[1] for b in bounds.values()])) / 2
+    
+    rows = []
+    for qr in sorted(located, key=lambda qr: center(qr)[1]):
+        if rows and center(qr)[1] - center(rows[-1][0])[1] <= tolerance:
+            rows[-1].append(qr)
+        else:
+            rows.append([qr])
+    return [qr for row in rows for qr in sorted(row, key=lambda qr: center(qr)[0])] + unlocated
+
+
+def predict_missing_centers(found: list[tuple[np.ndarray, float, float]], image_shape) -> list[np.ndarray]:
+    """
+    依已找到的 QR code 位置推測缺少的 QR code 中心
+    
+    卡片上的 QR code 大小相同且等距排列：兩個以上時沿著兩者的連線向外延伸，
+    距離超過兩倍邊長時也推測中間的位置；只有一個時推測上下左右相鄰的位置。
+    
+    Args:
+        found: 已找到的 QR code 幾何資訊（polygon_geometry 的結果）
+        image_shape: 圖片尺寸 (高, 寬, ...)
+        
+    Returns:
+        推測的中心點列表（已排除超出圖片或與已找到的 QR code 重疊的位置）
+    """
+    height, width = image_shape[:2]
+    size = float(np.median([geometry[1] for geometry in found]))
+    centers = [geometry[0] for geometry in found]
+    
+    candidates = []
+    if len(centers) >= 2:
+        for i, first in enumerate(centers):
+            for second in centers[i + 1:]:
+                step = second - first
+                candidates += [second + step, first - step]
+                if np.linalg.norm(step) > 2 * size:
+                    candidates.append((first + second) / 2)
+    else:
+        center, _, angle = found[0]
+        radians = np.deg2rad(angle)
+        axes = [np.array([np.cos(radians), np.sin(radians)]), np.array([-np.sin(radians), np.cos(radians)])]
+        for axis in axes:
+            candidates += [center + axis * size * 1.5, center - axis * size * 1.5]
+    
+    predicted = []
+    for candidate in candidates:
+        x, y = candidate
+        if not (0 <= x < width and 0 <= y < height):
+            continue
+        if any(np.linalg.norm(candidate - other) < size * 0.75 for other in centers + predicted):
+            continue
+        predicted.append(candidate)
+    return predicted
+
+
+def extract_region(gray, center: np.ndarray, size: float, angle: float,
+                   window_factor: float = 1.6, target_size: int = 300):
+    """
+    以推測的中心切出並轉正一塊區域（依需要放大）
+    
+    Args:
+        gray: 灰階原圖
+        center: 區域中心
+        size: QR code 邊長
+        angle: 旋轉角度（度），切出的區域會轉正
+        window_factor: 區域邊長相對於 QR code 邊長的倍數（容許位置誤差）
+        target_size: QR code 在切出區域中的目標邊長（像素）
+        
+    Returns:
+        (切出的區域, 區域座標轉回原圖座標的仿射矩陣) 的元組
+    """
+    scale = min(4.0, max(1.0, target_size / max(size, 1.0)))
+    # 只需轉正到 ±45 度以內，90 度的倍數不影響解碼
+    angle = (angle + 45) % 90 - 45
+    window = int(size * scale * window_factor)
+    matrix = cv2.getRotationMatrix2D((float(center[0]), float(center[1])), angle, scale)
+    matrix[:, 2] += (window / 2 - center[0], window / 2 - center[1])
+    region = cv2.warpAffine(gray, matrix, (window, window), flags=cv2.INTER_CUBIC, borderValue=255)
+    return region, cv2.invertAffineTransform(matrix)
+
+
+def region_variants(region, module_size: float) -> list:
+    """
+    回復階段對切出區域使用的加強前處理（依序嘗試）
+    
+    Args:
+        region: 切出的灰階區域
+        module_size: 區域中每個模組的估計邊長（像素）
+    """
+    enhanced = get_clahe(4.0, 4).apply(region)
+    blurred = cv2.GaussianBlur(enhanced, (0, 0), max(1.0, module_size / 2))
+    sharpened = cv2.addWeighted(enhanced, 1.5, blurred, -0.5, 0)
+    block_size = max(11, int(module_size * 4) | 1)
+    adaptive = cv2.adaptiveThreshold(
+        enhanced, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, block_size, 5
+    )
+    return [region, enhanced, sharpened, adaptive]
+
+
+class Deadline:
+    """
+    單張圖片的處理時限
+    
+    偵測流程在每個步驟之間檢查是否已超過時限，超過就停止並保留已找到的結果。
+    正在執行的單一偵測呼叫（pyzbar、OpenCV）無法中斷，實際耗時可能略超過時限。
+    """
+    
+    def __init__(self, seconds: float = 0):
+        """
+        Args:
+            seconds: 時限（秒），0 表示不限制
+        """
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds if seconds > 0 else None
+        self.timed_out = False
+    
+    def expired(self) -> bool:
+        """是否已超過時限（一旦超過即維持為 True）"""
+        if not self.timed_out and self.expires_at is not None and time.monotonic() >= self.expires_at:
+            self.timed_out = True
+        return self.timed_out
+
+
+class StrategyStats:
+    """
+    偵測方法的成效統計（單一 JSON 檔案）
+    
+    記錄最近 window 個新 QR code 各是由哪個偵測方法最先找到，
+    依找到的次數由多到少排列偵測方法，次數相同時維持預設順序。
+    統計會寫回檔案，下次執行與新的 worker 都從學到的順序開始。
+    """
+    
+    def __init__(self, path: str | None = None, window: int = 500, autosave: int = 0):
+        """
+        Args:
+            path: 統計檔案路徑，None 表示只在記憶體中統計
+            window: 保留最近多少筆記錄
+            autosave: 每記錄幾張圖片就寫回檔案一次（長時間執行的網頁伺服器使用），
+                0 表示只在呼叫 save 時寫入
+        """
+        self.path = Path(path) if path else None
+        self.window = window
+        self.autosave = autosave
+        self._unsaved = 0
+        self.wins = collections.deque(maxlen=window)
+        # 批次偵測的執行緒讀取順序時，其他執行緒可能正在記錄
+        self._lock = threading.Lock()
+        self._load()
+    
+    def __getstate__(self):
+        # 鎖無法傳給子行程，由各行程自行建立
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+    
+    def _load(self):
+        """讀取統計檔案，不存在或損毀時從空白開始"""
+        if self.path is None:
+            return
+        try:
+            data = json.loads(self.path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict) and isinstance(data.get('wins'), list):
+            self.wins.extend(str(name) for name in data['wins'])
+    
+    def record(self, methods: list[str]):
+        """記錄最先找到各個新 QR code 的偵測方法（一張圖片記錄一次）"""
+        with self._lock:
+            self.wins.extend(methods)
+            self._unsaved += 1
+            due = self.autosave and self._unsaved >= self.autosave
+        if due:
+            self.save()
+    
+    def counts(self) -> collections.Counter:
+        """各偵測方法在最近 window 筆記錄中找到的次數"""
+        with self._lock:
+            return collections.Counter(self.wins)
+    
+    def order(self, strategies: list[tuple]) -> list[tuple]:
+        """依找到的次數由多到少重新排列偵測方法（第一個欄位為方法名稱）"""
+        counts = self.counts()
+        return sorted(strategies, key=lambda strategy: -counts[strategy[0]])
+    
+    def save(self):
+        """
+        寫入統計檔案（先寫入暫存檔再取代）
+        
+        暫存檔名包含行程編號，多個行程（例如網頁伺服器與命令列）共用同一個統計檔案時不會互相覆寫。
+        """
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._unsaved = 0
+            data = {'version': 1, 'window': self.window, 'wins': list(self.wins)}
+            temp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+            temp_path.write_text(json.dumps(data, ensure_ascii=False), encoding='utf-8')
+            os.replace(temp_path, self.path)
+
+
+def convert_content(content: str) -> str:
+    """
+    將內容從 [CVS] 轉換為 [MyCard]
+    
+    Args:
+        content: 原始內容
+        
+    Returns:
+        轉換後的內容
+    """
+    # 替換 [CVS] 為 [MyCard]
+    return content.replace("[CVS]", "[MyCard]")
+
+
+def generate_qrcode_image(content: str, encoding_profile: str = "auto") -> Image.Image:
+    """依編碼設定檔生成 QR code 圖片（直接由模組矩陣放大，不逐格繪製）"""
+    return render_qrcode_image(get_qrcode_encoder(encoding_profile).make(content))
+
+
+def generate_qrcode_png(content: str, encoding_profile: str = "auto") -> bytes:
+    """生成 QR code 並編碼為 PNG bytes"""
+    png_buffer = io.BytesIO()
+    generate_qrcode_image(content, encoding_profile).save(png_buffer, format='PNG')
+    return png_buffer.getvalue()
+
+
+def convert_qrcodes(contents: list[str], encoding_profile: str = "auto") -> list[dict]:
+    """
+    轉換每個 QR code 的內容並生成新的 QR code
+    
+    Returns:
+        每個 QR code 的結果：index（從 1 開始的序號）、original（原始內容）、
+        converted（轉換後內容）、png_bytes（新 QR code 的 PNG）
+    """
+    results = []
+    for idx, content in enumerate(contents, 1):
+        converted = convert_content(content)
+        results.append({
+            'index': idx,
+            'original': content,
+            'converted': converted,
+            'png_bytes': generate_qrcode_png(converted, encoding_profile),
+        })
+    return results
+
+
+class QRCodeEngine:
+    """
+    QR code 偵測引擎
+    
+    依設定組合偵測流程：分塊、金字塔、定位、依位置回復與整張圖片的偵測方法，
+    命令列與網頁版本使用同一個引擎，相同設定下對相同圖片得到相同結果。
+    
+    引擎本身不保存單張圖片的狀態，可由多個執行緒（例如網頁的多個連線）共用。
+    """
+    
+    def __init__(self, expected_count: int = 3, recover_missing: bool = True, localize: bool = True,
+                 pyramid: bool = True, tile_size: int = 0, strategy_stats: StrategyStats | None = None,
+                 time_budget: float = 0, threads: int = 1, verbose: bool = True):
+        """
+        Args:
+            expected_count: 每張圖片預期的 QR code 數量，偵測到這個數量後
+                即停止嘗試其他方法；設為 0 則一律執行所有偵測方法
+            recover_missing: QR code 數量不足時，是否依已找到的位置推測並解碼缺少的 QR code
+            localize: 是否先在縮小圖上定位 QR code，只對候選區域解碼
+            pyramid: 是否先在依圖片尺寸縮小的圖上解碼，仍有缺少才改用原尺寸
+            tile_size: 分塊模式的區塊邊長（像素）；圖片大於此尺寸時改為分塊偵測，
+                0 表示不分塊
+            strategy_stats: 偵測方法成效統計，None 表示一律使用預設順序
+            time_budget: 每張圖片的偵測時限（秒），超過即停止並保留已找到的結果；0 表示不限制
+            threads: 分塊模式與批次偵測（未指定 workers 時）使用的執行緒數量；
+                與 OpenCV 執行緒數量相乘不應超過可用 CPU（見 configure_runtime）
+            verbose: 是否輸出偵測過程的訊息
+        """
+        self.expected_count = expected_count
+        self.recover_missing = recover_missing
+        self.localize = localize
+        self.pyramid = pyramid
+        self.tile_size = tile_size
+        self.strategy_stats = strategy_stats
+        self.time_budget = time_budget
+        self.threads = max(1, threads)
+        self.verbose = verbose
+    
+    def _log(self, message: str):
+        """
+        輸出偵測過程的訊息（verbose 為 False 時不輸出）
+        
+        批次偵測時先收集在目前執行緒的緩衝區，由呼叫端依輸入順序印出，避免互相交錯。
+        """
+        if not self.verbose:
+            return
+        log_buffer = getattr(_worker_state, 'log_buffer', None)
+        if log_buffer is not None:
+            log_buffer.append(message)
+        else:
+            print(message)
+    
+    def _is_complete(self, detected_qrcodes: list) -> bool:
+        """是否已偵測到預期數量的 QR code（expected_count 為 0 時永不提早結束）"""
+        return self.expected_count > 0 and len(detected_qrcodes) >= self.expected_count
+    
+    def _detect_pyzbar(self, image) -> list[tuple[str, list]]:
+        """使用 pyzbar 偵測圖片中的 QR code，返回 (內容, 四邊形頂點) 列表"""
+        return [
+            (obj.data.decode('utf-8'), [[point.x, point.y] for point in obj.polygon])
+            for obj in decode(image)
+            if obj.type == 'QRCODE'
+        ]
+    
+    def _detect_opencv(self, image) -> list[tuple[str, list]]:
+        """使用 OpenCV 的 detectAndDecodeMulti 偵測 QR code，返回 (內容, 四邊形頂點) 列表"""
+        detector = get_qrcode_detector()
+        success, decoded_info, points, _ = detector.detectAndDecodeMulti(image)
+        if success and decoded_info:
+            return [
+                (data, [[int(x), int(y)] for x, y in quad])
+                for data, quad in zip(decoded_info, points)
+            ]
+        return []
+    
+    def _strategies(self, adaptive: bool = True) -> list[tuple[str, str, object, str]]:
+        """
+        取得依序執行的偵測方法
+        
+        Args:
+            adaptive: 是否依成效統計排列（停用調整時一律為預設順序）
+            
+        Returns:
+            (方法名稱, 說明, 偵測函式, 使用的圖片) 的列表
+        """
+        strategies = []
+        if PYZBAR_AVAILABLE:
+            strategies += [
+                ("pyzbar_original", "pyzbar 在原圖", self._detect_pyzbar, 'image'),  # 方法 1: 更準確
+                ("pyzbar_gray", "pyzbar 在灰階圖", self._detect_pyzbar, 'gray'),  # 方法 2
+                ("pyzbar_clahe", "pyzbar 在增強對比度圖", self._detect_pyzbar, 'enhanced'),  # 方法 3
+            ]
+        strategies.append(("opencv_multi", "OpenCV Multi 在原圖", self._detect_opencv, 'bgr'))  # 方法 4
+        if PYZBAR_AVAILABLE:
+            strategies.append(("pyzbar_binary", "pyzbar 在二值化圖", self._detect_pyzbar, 'binary'))  # 方法 5
+        if adaptive and self.strategy_stats is not None:
+            strategies = self.strategy_stats.order(strategies)
+        return strategies
+    
+    def detector_signature(self) -> str:
+        """偵測設定的識別字串，設定改變時快取結果即失效"""
+        # 使用預設順序，調整順序不影響快取與輸出清單
+        methods = ",".join(name for name, _, _, _ in self._strategies(adaptive=False))
+        if self.localize:
+            methods = "localize," + methods
+        if self.pyramid:
+            methods = "pyramid," + methods
+        if self.recover_missing:
+            methods += ",geometry_recovery"
+        if self.tile_size:
+            methods += f",tile={self.tile_size},tile_fallback"
+        return f"v2|{methods}|expected={self.expected_count}|opencv={cv2.__version__}"
+    
+    def _decode_region(self, region) -> list[tuple[str, list]]:
+        """在切出的小區域上偵測 QR code（pyzbar 與 OpenCV）"""
+        results = self._detect_pyzbar(region) if PYZBAR_AVAILABLE else []
+        if not results:
+            results = [(data, polygon) for data, polygon in self._detect_opencv(region) if data]
+        for detector in (get_qrcode_detector(), get_aruco_qrcode_detector()):
+            if results or detector is None:
+                break
+            data, points, _ = detector.detectAndDecode(region)
+            if data and points is not None:
+                results = [(data, [[float(x), float(y)] for x, y in points.reshape(-1, 2)])]
+        return results
+    
+    def _recover_missing(self, context: PreprocessContext, detected_qrcodes: list[dict],
+                         detected_data_set: set, deadline: Deadline) -> int:
+        """
+        依已找到的 QR code 推測缺少的 QR code 位置，只在該區域加強處理後解碼
+        
+        比起再對整張圖片執行一次偵測，只處理推測位置的小區域便宜得多。
+        
+        Returns:
+            新找到的 QR code 數量
+        """
+        found = [polygon_geometry(qr['polygon']) for qr in detected_qrcodes if qr['polygon']]
+        if not found:
+            return 0
+        
+        recovered = 0
+        for center in predict_missing_centers(found, context.gray.shape):
+            if self._is_complete(detected_qrcodes) or deadline.expired():
+                break
+            size = float(np.median([geometry[1] for geometry in found]))
+            angle = found[0][2]
+            region, inverse = extract_region(context.gray, center, size, angle)
+            # 放大後每個模組的邊長，以版本 4（33 個模組）估計
+            module_size = region.shape[0] / 1.6 / 33
+            for variant in region_variants(region, module_size):
+                results = [(data, polygon) for data, polygon in self._decode_region(variant)
+                           if data and data not in detected_data_set]
+                if not results:
+                    continue
+                for data, polygon in results:
+                    points = cv2.transform(np.array([polygon], dtype=np.float32), inverse)[0]
+                    polygon = [[int(round(x)), int(round(y))] for x, y in points]
+                    if add_detection(detected_qrcodes, data, 'geometry_recovery', polygon):
+                        detected_data_set.add(data)
+                        recovered += 1
+                        self._log(f"     → QR code: {data[:50]}...")
+                break
+        return recovered
+    
+    def _add_results(self, results: list[tuple[str, list]], method: str, detected_qrcodes: list[dict],
+                     detected_data_set: set, offset: tuple[int, int] = (0, 0), scale: float = 1.0) -> int:
+        """
+        加入尚未出現過的 QR code（polygon 依 scale 與 offset 轉回原圖座標，依內容與位置去重）
+        
+        Returns:
+            新加入的數量
+        """
+        added = 0
+        offset_x, offset_y = offset
+        for data, polygon in results:
+            polygon = [[round(x / scale) + offset_x, round(y / scale) + offset_y] for x, y in polygon]
+            if add_detection(detected_qrcodes, data, method, polygon):
+                detected_data_set.add(data)
+                added += 1
+                self._log(f"     → QR code: {data[:50]}...")
+        return added
+    
+    def _decode_localized(self, context: PreprocessContext, detected_qrcodes: list[dict],
+                          detected_data_set: set, deadline: Deadline) -> int:
+        """
+        先在縮小圖上定位候選區域，只對區域切圖執行各種偵測方法
+        
+        每個區域的灰階、CLAHE、二值化圖都只在切圖上計算，
+        找到該區域的 QR code 後就換下一個區域。
+        
+        Returns:
+            定位到的候選區域數量
+        """
+        regions = locate_qrcode_regions(context.gray)
+        self._log(f"  📍 在縮小圖上定位到 {len(regions)} 個候選區域")
+        
+        # 金字塔階段已解出的 QR code，其中心所在的區域不必再處理
+        found_centers = [polygon_geometry(qr['polygon'])[0] for qr in detected_qrcodes]
+        for x0, y0, x1, y1 in regions:
+            if self._is_complete(detected_qrcodes) or deadline.expired():
+                break
+            if any(x0 <= cx < x1 and y0 <= cy < y1 for cx, cy in found_centers):
+                continue
+            region_context = PreprocessContext(context.gray[y0:y1, x0:x1])
+            for name, detect_func, variant_image in self._distinct_variants(region_context):
+                results = detect_func(variant_image)
+                if self._add_results(results, name, detected_qrcodes, detected_data_set, (x0, y0)):
+                    break
+        return len(regions)
+    
+    def _distinct_variants(self, context: PreprocessContext):
+        """
+        依序產生 (方法名稱, 偵測函式, 圖片)，略過與先前方法使用同一張圖片的方法
+        
+        灰階的切圖或縮小圖中，原圖與灰階圖是同一張，不必重複偵測。
+        """
+        tried = set()
+        for name, label, detect_func, variant in self._strategies():
+            variant_image = getattr(context, variant)
+            key = (detect_func.__name__, id(variant_image))
+            if key in tried:
+                continue
+            tried.add(key)
+            yield name, detect_func, variant_image
+    
+    def _decode_pyramid(self, context: PreprocessContext, detected_qrcodes: list[dict],
+                        detected_data_set: set, deadline: Deadline) -> float | None:
+        """
+        依過去的成功率，由最常找到 QR code 的比例開始在縮小圖上執行各種偵測方法
+        
+        縮小圖直接以縮小的灰階解碼取得（見 PreprocessContext.reduced），
+        CLAHE、二值化圖都只在縮小圖上計算，找到的 polygon 會換算回原圖座標。
+        在某個比例找到新的 QR code 即記為成功（不必找齊），
+        QR code 本來就比較少的圖片不會讓該比例被略過。
+        
+        Returns:
+            找齊 expected_count 個 QR code 的比例；仍有缺少時返回 None
+        """
+        stats = get_scale_stats()
+        for scale in pyramid_levels(context.shape, stats):
+            if deadline.expired():
+                break
+            found = 0
+            for name, detect_func, variant_image in self._distinct_variants(context.reduced(scale)):
+                if deadline.expired():
+                    break
+                results = detect_func(variant_image)
+                found += self._add_results(results, name, detected_qrcodes, detected_data_set, scale=scale)
+                if self._is_complete(detected_qrcodes):
+                    break
+            self._log(f"  🔻 {scale:g} 倍縮小圖累計偵測到 {len(detected_qrcodes)} 個 QR code")
+            succeeded, attempted, _ = stats.get(scale, (0, 0, 0))
+            stats[scale] = [succeeded + (found > 0), attempted + 1, 0]
+            complete = self._is_complete(detected_qrcodes)
+            if complete:
+                return scale
+        return None
+    
+    def _decode_tile(self, gray, box: tuple[int, int, int, int], deadline: Deadline) -> list[tuple[str, list]]:
+        """
+        在單一區塊上依序執行各種偵測方法（在分塊模式的執行緒中執行，不輸出訊息）
+        
+        CLAHE、二值化圖只在區塊上計算，不必為整張圖片額外配置這些中間圖片
+        （整張的灰階圖仍會完整解碼一次，由各區塊共用）。
+        
+        Returns:
+            (方法名稱, 偵測結果) 的列表，polygon 為區塊內的座標
+        """
+        x0, y0, x1, y1 = box
+        tile_context = PreprocessContext(gray[y0:y1, x0:x1])
+        results = []
+        for name, detect_func, variant_image in self._distinct_variants(tile_context):
+            if deadline.expired():
+                break
+            results.append((name, detect_func(variant_image)))
+        return results
+    
+    def _decode_tiled(self, context: PreprocessContext, detected_qrcodes: list[dict],
+                      detected_data_set: set, deadline: Deadline):
+        """
+        將灰階圖切成互相重疊的區塊，以多個執行緒分別偵測後依位置合併
+        
+        區塊的重疊寬度依縮小圖上定位到的 QR code 大小決定（見 tile_layout）。
+        一張掃描圖可能有多張卡片，數量超過 expected_count 也一律處理所有區塊，只在超過時限時停止。
+        各區塊的結果依區塊順序（由上而下、由左而右）合併，
+        重疊區域中重複出現的 QR code 只保留一次。
+        """
+        gray = context.gray
+        tile_size, overlap = tile_layout(gray, self.tile_size)
+        boxes = tile_boxes(gray.shape, tile_size, min_overlap=overlap)
+        threads = min(len(boxes), self.threads)
+        self._log(f"  🧱 分塊偵測：{len(boxes)} 個 {tile_size}px 區塊（重疊 {overlap}px），{threads} 個執行緒")
+        
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            futures = [executor.submit(self._decode_tile, gray, box, deadline) for box in boxes]
+            for (x0, y0, _, _), future in zip(boxes, futures):
+                for name, results in future.result():
+                    self._add_results(results, name, detected_qrcodes, detected_data_set, (x0, y0))
+                if deadline.expired():
+                    for pending in futures:
+                        pending.cancel()
+                    break
+        self._log(f"  🧱 區塊合併後共 {len(detected_qrcodes)} 個 QR code")
+    
+    def _run_strategies(self, context: PreprocessContext, deadline: Deadline) -> list[dict]:
+        """
+        依序執行偵測方法，偵測到 expected_count 個不重複的 QR code 即停止
+        
+        圖片大於分塊大小時，改為分塊偵測灰階圖（處理所有區塊）後再依位置推測缺少的 QR code；
+        數量仍不足時只在灰階圖上補救（縮小圖金字塔與候選區域），
+        不計算整張圖片的彩色、CLAHE 與二值化圖，也不執行整張圖片的偵測方法。
+        啟用金字塔時，先在依圖片尺寸縮小的圖上執行偵測（從過去最常成功的比例開始），
+        找齊就不必處理原尺寸圖片，否則只對仍缺少的 QR code 改用原尺寸。
+        啟用定位時，先只對縮小圖上定位到的候選區域執行偵測，數量足夠就不必處理整張圖片。
+        每當有新的 QR code 但數量仍不足時，先依已找到的位置推測缺少的 QR code
+        並只解碼推測的區域，仍找不到才執行下一個整張圖片的偵測方法。
+        
+        Args:
+            context: 圖片的前處理快取（灰階、CLAHE、二值化圖只在需要時計算一次，各方法共用）
+            deadline: 這張圖片的時限，超過即停止並返回已找到的結果
+            
+        Returns:
+            偵測結果列表，每筆包含 data（內容）、method（方法名稱）、polygon（四邊形頂點）
+        """
+        detected_qrcodes = []
+        detected_data_set = set()  # 用於去重
+        
+        strategies = self._strategies()
+        
+        def try_recovery():
+            if self.recover_missing and self.expected_count > 0 and detected_qrcodes \
+                    and not self._is_complete(detected_qrcodes) and not deadline.expired():
+                recovered = self._recover_missing(context, detected_qrcodes, detected_data_set, deadline)
+                self._log(f"  🎯 依已知位置推測缺少的 QR code，找回 {recovered} 個")
+        
+        if self.tile_size and max(context.shape) > self.tile_size:
+            self._decode_tiled(context, detected_qrcodes, detected_data_set, deadline)
+            try_recovery()
+            if self._is_complete(detected_qrcodes) or (detected_qrcodes and self.expected_count == 0) \
+                    or deadline.expired():
+                return detected_qrcodes
+            self._log(f"  🧱 分塊只找到 {len(detected_qrcodes)} 個，改在縮小圖與候選區域上補救")
+            if self.pyramid and self.expected_count > 0:
+                self._decode_pyramid(context, detected_qrcodes, detected_data_set, deadline)
+            if self.localize and not self._is_complete(detected_qrcodes) and not deadline.expired():
+                self._decode_localized(context, detected_qrcodes, detected_data_set, deadline)
+                try_recovery()
+            return detected_qrcodes
+        
+        if self.pyramid and self.expected_count > 0:
+            scale = self._decode_pyramid(context, detected_qrcodes, detected_data_set, deadline)
+            if scale is not None:
+                self._log(f"  ⏩ {scale:g} 倍縮小圖已找到 {len(detected_qrcodes)} 個，略過原尺寸偵測")
+                return detected_qrcodes
+        
+        if self.localize and not deadline.expired():
+            self._decode_localized(context, detected_qrcodes, detected_data_set, deadline)
+            try_recovery()
+            if self._is_complete(detected_qrcodes):
+                self._log(f"  ⏩ 候選區域已找到 {len(detected_qrcodes)} 個，略過整張圖片的偵測")
+                return detected_qrcodes
+        
+        for idx, (name, label, detect_func, variant) in enumerate(strategies):
+            if deadline.expired():
+                break
+            results = detect_func(getattr(context, variant))
+            self._log(f"  🔍 {label}偵測到 {len(results)} 個 QR code")
+            if self._add_results(results, name, detected_qrcodes, detected_data_set):
+                try_recovery()
+            
+            if self._is_complete(detected_qrcodes):
+                skipped = len(strategies) - idx - 1
+                if skipped:
+                    self._log(f"  ⏩ 已達預期數量 {self.expected_count} 個，略過其餘 {skipped} 種方法")
+                break
+        
+        return detected_qrcodes
+    
+    def decode_context(self, context: PreprocessContext, deadline: Deadline | None = None) -> list[dict]:
+        """
+        偵測圖片中的 QR code
+        
+        Args:
+            context: 圖片的前處理快取
+            deadline: 這張圖片的時限，None 表示依 time_budget 建立；
+                超過時限時返回已找到的部分結果，並將 deadline.timed_out 設為 True
+                
+        Returns:
+            依閱讀順序（由上而下、由左而右）排列的偵測結果列表，
+            每筆包含 data（內容）、method（方法名稱）、polygon（四邊形頂點）
+        """
+        if deadline is None:
+            deadline = Deadline(self.time_budget)
+        # 依位置排序，輸出檔名的編號每次執行都對應同一個 QR code
+        return sort_reading_order(self._run_strategies(context, deadline))
+    
+    def decode(self, image_bytes: bytes, deadline: Deadline | None = None) -> list[dict]:
+        """
+        偵測圖片檔案內容（JPEG、PNG 等）中的 QR code
+        
+        圖片延後解碼：縮小圖與灰階圖直接以對應的旗標解碼，需要時才做完整的彩色解碼。
+        
+        Raises:
+            ValueError: 無法解碼圖片
+        """
+        context = PreprocessContext.from_bytes(image_bytes)
+        height, width = context.shape
+        self._log(f"  📐 圖片尺寸: {width}x{height}")
+        return self.decode_context(context, deadline)
+    
+    def decode_image(self, image, color_order: str = "BGR", deadline: Deadline | None = None) -> list[dict]:
+        """
+        偵測已解碼圖片（numpy array，灰階或彩色）中的 QR code
+        
+        Raises:
+            ValueError: 不支援的資料型別或通道數量（見 PreprocessContext）
+        """
+        return self.decode_context(PreprocessContext(image, color_order), deadline)
+    
+    def decode_item(self, image, color_order: str = "BGR",
+                    deadline: Deadline | None = None) -> tuple[dict, list[str]]:
+        """
+        偵測一張圖片並收集偵測過程的訊息（供批次偵測與處理管線在多個執行緒中使用）
+        
+        無法解碼、內容為空、格式不支援或 OpenCV 處理失敗的圖片不拋出例外，
+        只在結果的 error 中記錄，批次中的其他圖片不受影響。
+        
+        Args:
+            image: 圖片檔案內容（bytes 等）或已解碼的圖片（numpy array）
+            color_order: numpy array 彩色圖片的通道順序
+            deadline: 這張圖片的時限，None 表示依 time_budget 建立
+            
+        Returns:
+            (偵測結果, 偵測過程的訊息) 的元組，偵測結果的格式見 iter_decode_batch
+        """
+        if deadline is None:
+            deadline = Deadline(self.time_budget)
+        log_buffer = _worker_state.log_buffer = []
+        try:
+            if isinstance(image, np.ndarray):
+                detected_qrcodes = self.decode_image(image, color_order, deadline)
+            else:
+                detected_qrcodes = self.decode(image, deadline)
+            error = None
+        except (ValueError, cv2.error) as e:
+            self._log(f"  ❌ {e}")
+            detected_qrcodes, error = [], "無法讀取圖片"
+        finally:
+            _worker_state.log_buffer = None
+        result = {'qrcodes': detected_qrcodes, 'timed_out': deadline.timed_out, 'error': error}
+        return result, log_buffer
+    
+    def _decode_batch_item(self, image, color_order: str, time_budget: float) -> tuple[dict, list[str]]:
+        """偵測批次中的一張圖片（時限從開始偵測時起算，不含排隊等待的時間）"""
+        return self.decode_item(image, color_order, Deadline(time_budget))
+    
+    def iter_decode_batch(self, images, color_order: str = "BGR", workers: int | None = None,
+                          time_budget: float | None = None):
+        """
+        批次偵測多張圖片，依輸入順序逐一產生每張圖片的結果
+        
+        偵測器、CLAHE 等物件由每個執行緒建立一次後沿用到整批圖片，
+        同時送出的圖片數量限制為執行緒數量的兩倍，輸入可以是產生器，記憶體用量不隨批次大小增加。
+        每張圖片的偵測方法依序記入成效統計，後面的圖片即從學到的順序開始。
+        
+        Args:
+            images: 圖片的可迭代物件，每張為圖片檔案內容（bytes、bytearray、memoryview）
+                或已解碼的圖片（numpy array，灰階或彩色）
+            color_order: numpy array 彩色圖片的通道順序，cv2 為 "BGR"，PIL 為 "RGB"
+            workers: 同時偵測的執行緒數量，None 表示使用 threads
+            time_budget: 每張圖片的偵測時限（秒），None 表示使用 time_budget
+            
+        Yields:
+            每張圖片的結果：qrcodes（依閱讀順序排列的偵測結果，包含 data、method、polygon）、
+            timed_out（是否超過時限，qrcodes 為部分結果）、error（無法讀取圖片時的錯誤訊息，否則為 None）
+        """
+        workers = max(1, workers or self.threads)
+        if time_budget is None:
+            time_budget = self.time_budget
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = collections.deque()
+            images = iter(images)
+            while True:
+                for image in images:
+                    pending.append(executor.submit(self._decode_batch_item, image, color_order, time_budget))
+                    if len(pending) >= workers * 2:
+                        break
+                if not pending:
+                    return
+                result, log_lines = pending.popleft().result()
+                for line in log_lines:
+                    print(line)
+                self.record([qr['method'] for qr in result['qrcodes']])
+                yield result
+    
+    def decode_batch(self, images, color_order: str = "BGR", workers: int | None = None,
+                     time_budget: float | None = None) -> list[dict]:
+        """
+        批次偵測多張圖片，返回與輸入順序相同的結果列表（參數與結果格式見 iter_decode_batch）
+        """
+        return list(self.iter_decode_batch(images, color_order, workers, time_budget))
+    
+    def strategy_names(self) -> list[str]:
+        """目前的偵測方法順序"""
+        return [name for name, _, _, _ in self._strategies()]
+    
+    def record(self, methods: list[str]):
+        """將最先找到各個 QR code 的偵測方法（偵測結果的 method）記入成效統計"""
+        if self.strategy_stats is None:
+            return
+        names = {name for name, _, _, _ in self._strategies(adaptive=False)}
+        self.strategy_stats.record([method for method in methods if method in names])
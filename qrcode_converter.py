@@ -6,162 +6,568 @@ QR Code 轉換程式
 然後生成新的 QR code 儲存到 output 資料夾
 """
 
+import io
 import os
+import copy
+import json
+import time
+import fnmatch
+import hashlib
+import queue
+import sqlite3
+import tarfile
+import zipfile
+import argparse
+import functools
+import threading
+import traceback
+import contextlib
+import collections
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import util as multiprocessing_util
 import cv2
-import qrcode
 import shutil
 from pathlib import Path
-try:
-    from pyzbar.pyzbar import decode
-    PYZBAR_AVAILABLE = True
-except ImportError:
-    PYZBAR_AVAILABLE = False
-    print("⚠️  pyzbar 未安裝，將使用 OpenCV 偵測器（可能較不準確）")
-    print("   建議安裝: pip3 install pyzbar")
+
+from qr_engine import (
+    ENCODING_PROFILES,
+    Deadline,
+    QRCodeEngine,
+    StrategyStats,
+    configure_runtime,
+    convert_content,
+    format_runtime,
+    generate_qrcode_image,
+    generate_qrcode_png,
+)
+
+
+# 子行程的轉換器（由 _init_worker 在每個子行程建立一次）
+_worker_converter = None
+
+
+def _init_worker(opencv_threads: int, converter: "QRCodeConverter | None" = None):
+    """
+    子行程初始化：套用與主行程相同的 OpenCV 執行緒設定，並保存這個行程使用的轉換器
+    
+    轉換器（不含輸出清單與封存檔的精簡副本）只在建立子行程時傳送一次，
+    解碼快取的資料庫連線也在這裡建立，整個子行程共用一個連線，結束時關閉。
+    """
+    global _worker_converter
+    cv2.setNumThreads(opencv_threads)
+    _worker_converter = converter
+    if converter is not None and converter.decode_cache is not None:
+        converter.decode_cache._connect()
+        # 行程池的子行程不會執行 atexit，改由 multiprocessing 在子行程結束時關閉連線
+        multiprocessing_util.Finalize(converter.decode_cache, converter.decode_cache.close, exitpriority=10)
+
+
+def _prepare_file_in_worker(image_path: Path) -> tuple[dict, str]:
+    """在子行程中執行寫入以外的處理階段（見 QRCodeConverter._prepare_file_captured）"""
+    return _worker_converter._prepare_file_captured(image_path)
+
+
+# 輸出清單檔名（位於輸出資料夾中）
+MANIFEST_FILENAME = "manifest.json"
+
+# 封存輸出支援的格式（依副檔名）
+ARCHIVE_FORMATS = {'.zip': 'zip', '.tar': 'tar'}
+
+
+class ArchiveSink:
+    """
+    將輸出檔案依序串流寫入單一 ZIP 或 TAR 封存檔
+    
+    不在輸出資料夾中逐一建立檔案，也不必事後再讀回壓縮。
+    PNG 本身已經過壓縮，ZIP 中一律不再壓縮（ZIP_STORED）。
+    封存檔先寫入暫存檔，關閉時加入輸出清單（manifest.json）後才取代目標檔案；
+    處理中斷時以 abort 捨棄暫存檔，原本的封存檔維持不變。
+    處理管線的多個寫入執行緒共用時以鎖保護。
+    """
+    
+    def __init__(self, path: str):
+        """
+        Args:
+            path: 封存檔路徑，副檔名決定格式（.zip 或 .tar）
+            
+        Raises:
+            ValueError: 不支援的副檔名
+        """
+        self.path = Path(path)
+        suffix = self.path.suffix.lower()
+        if suffix not in ARCHIVE_FORMATS:
+            raise ValueError(f"不支援的封存格式: {self.path.name}（支援 {'、'.join(ARCHIVE_FORMATS)}）")
+        self.format = ARCHIVE_FORMATS[suffix]
+        self.count = 0
+        self._lock = threading.Lock()
+        self._temp_path = self.path.with_name(self.path.name + ".tmp")
+        self._archive = None
+    
+    def _open(self):
+        """第一次寫入時才建立暫存的封存檔"""
+        if self._archive is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if self.format == 'zip':
+                self._archive = zipfile.ZipFile(self._temp_path, 'w', compression=zipfile.ZIP_STORED)
+            else:
+                self._archive = tarfile.open(self._temp_path, 'w', format=tarfile.PAX_FORMAT)
+        return self._archive
+    
+    def __getstate__(self):
+        # 封存檔只由主行程寫入，子行程不需要開啟的檔案與鎖
+        state = self.__dict__.copy()
+        state['_archive'] = None
+        del state['_lock']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+    
+    def write(self, name: str, data: bytes):
+        """將一個檔案寫入封存檔（name 為封存檔中的路徑，以 / 分隔）"""
+        with self._lock:
+            archive = self._open()
+            if self.format == 'zip':
+                info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+                info.compress_type = zipfile.ZIP_STORED
+                archive.writestr(info, data)
+            else:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = int(time.time())
+                archive.addfile(info, io.BytesIO(data))
+            self.count += 1
+    
+    def close(self, manifest: dict):
+        """加入輸出清單並關閉封存檔，完成後取代目標檔案"""
+        self.write(MANIFEST_FILENAME, json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'))
+        with self._lock:
+            self._archive.close()
+            self._archive = None
+        os.replace(self._temp_path, self.path)
+    
+    def abort(self):
+        """關閉並刪除暫存的封存檔，不取代目標檔案"""
+        with self._lock:
+            if self._archive is not None:
+                try:
+                    self._archive.close()
+                except Exception:
+                    pass  # 中斷在寫入途中時暫存檔可能不完整，反正即將刪除
+                self._archive = None
+        self._temp_path.unlink(missing_ok=True)
+
+
+# 輸出檔案的資料夾配置
+OUTPUT_LAYOUTS = {
+    'mirror': "保留輸入資料夾的子資料夾結構",
+    'flat': "全部放在輸出資料夾最上層",
+    'hash': "依輸入路徑的雜湊分散到兩層子資料夾（如 3f/a2/）",
+    'date': "依輸入檔案的修改日期分資料夾（如 2024/05/17/）",
+}
+# hash 配置的子資料夾層數（每層為雜湊的 2 個十六進位字元，即 256 個子資料夾）
+HASH_SHARD_LEVELS = 2
+# mirror 以外的配置中，併入檔名的子資料夾路徑後附加的雜湊長度（十六進位字元）
+PARENT_HASH_LENGTH = 8
+
+# 處理管線的階段與各階段預設的執行緒數量（decode 預設使用 --workers 的數量）
+PIPELINE_STAGES = ('load', 'decode', 'encode', 'write')
+DEFAULT_STAGE_THREADS = {'load': 2, 'decode': 1, 'encode': 1, 'write': 2}
+# 階段之間佇列的長度上限
+PIPELINE_QUEUE_SIZE = 8
+
+# 佇列中的結束訊號
+_PIPELINE_END = object()
+
+
+class StagedPipeline:
+    """
+    以有界佇列串接的多階段處理流程
+    
+    每個階段有自己的執行緒數量，前一個階段的輸出放入佇列後由下一個階段取出，
+    佇列已滿時前一個階段會等待，同時在處理中的項目數量不超過
+    佇列長度總和加上執行緒數量。完成的項目依完成順序產生。
+    """
+    
+    def __init__(self, stages: list[tuple[str, object, int]], queue_size: int = PIPELINE_QUEUE_SIZE):
+        """
+        Args:
+            stages: (階段名稱, 處理函式, 執行緒數量) 的列表，處理函式接收一個項目並返回處理後的項目
+            queue_size: 階段之間佇列的長度上限
+        """
+        self.stages = stages
+        self.queue_size = queue_size
+    
+    def _put(self, target: queue.Queue, item) -> bool:
+        """放入佇列，佇列已滿時等待；流程已停止時放棄並返回 False"""
+        while not self._stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _get(self, source: queue.Queue):
+        """從佇列取出項目，佇列為空時等待；流程已停止時返回結束訊號"""
+        while not self._stop.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _PIPELINE_END
+    
+    def _fail(self, error: BaseException):
+        """記錄第一個錯誤並停止整個流程"""
+        with self._lock:
+            if self._error is None:
+                self._error = error
+        self._stop.set()
+    
+    def _feed(self, items, target: queue.Queue):
+        """將輸入項目依序放入第一個佇列（輸入可以是產生器，只在佇列有空間時才取下一個）"""
+        try:
+            for item in items:
+                if not self._put(target, item):
+                    return
+            self._put(target, _PIPELINE_END)
+        except BaseException as e:
+            self._fail(e)
+    
+    def _work(self, func, source: queue.Queue, target: queue.Queue, remaining: list[int]):
+        """階段的工作執行緒：取出項目處理後放入下一個佇列，收到結束訊號時結束"""
+        try:
+            while True:
+                item = self._get(source)
+                if item is _PIPELINE_END:
+                    # 結束訊號放回佇列讓同一階段的其他執行緒也能收到，最後一個結束的執行緒通知下一個階段
+                    self._put(source, _PIPELINE_END)
+                    with self._lock:
+                        remaining[0] -= 1
+                        last = remaining[0] == 0
+                    if last:
+                        self._put(target, _PIPELINE_END)
+                    return
+                if not self._put(target, func(item)):
+                    return
+        except BaseException as e:
+            self._fail(e)
+    
+    def run(self, items):
+        """
+        處理所有輸入項目，依完成順序逐一產生處理後的項目
+        
+        任一階段拋出例外時停止整個流程，並在產生完已完成的項目後拋出該例外。
+        """
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._error = None
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0]), daemon=True)]
+        for idx, (name, func, count) in enumerate(self.stages):
+            remaining = [max(1, count)]
+            threads += [
+                threading.Thread(
+                    target=self._work, args=(func, queues[idx], queues[idx + 1], remaining),
+                    name=f"{name}-{n}", daemon=True,
+                )
+                for n in range(remaining[0])
+            ]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self._get(queues[-1])
+                if item is _PIPELINE_END:
+                    break
+                yield item
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+class DecodeCache:
+    """
+    以圖片內容雜湊為鍵的解碼快取（單一 SQLite 檔案）
+    
+    每筆記錄保存解碼內容、每個 QR code 的位置與偵測方法，
+    依圖片雜湊加上偵測設定識別，超過保存期限或數量上限時淘汰最久未使用的記錄。
+    """
+    
+    def __init__(self, path: str, max_entries: int = 100000, max_age_days: float = 30):
+        """
+        Args:
+            path: SQLite 快取檔案路徑
+            max_entries: 最多保留的記錄數量
+            max_age_days: 記錄在多少天未使用後淘汰
+        """
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self._connection = None
+        self._connection_pid = None
+        # 處理管線的多個執行緒共用同一個連線
+        self._lock = threading.Lock()
+    
+    def __getstate__(self):
+        # 資料庫連線與鎖無法傳給子行程，由各行程自行建立
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        state['_connection_pid'] = None
+        del state['_lock']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def hash_bytes(data: bytes) -> str:
+        """計算圖片內容的雜湊值"""
+        return hashlib.sha256(data).hexdigest()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """取得目前行程的資料庫連線（第一次使用時建立資料表）"""
+        if self._connection is None or self._connection_pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS decode_cache ("
+                " image_hash TEXT NOT NULL,"
+                " config TEXT NOT NULL,"
+                " results TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL,"
+                " PRIMARY KEY (image_hash, config))"
+            )
+            connection.commit()
+            self._connection = connection
+            self._connection_pid = os.getpid()
+        return self._connection
+    
+    def get(self, image_hash: str, config: str) -> list[dict] | None:
+        """取得快取的偵測結果，沒有快取時返回 None"""
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT results FROM decode_cache WHERE image_hash = ? AND config = ?",
+                (image_hash, config),
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE decode_cache SET accessed_at = ? WHERE image_hash = ? AND config = ?",
+                (time.time(), image_hash, config),
+            )
+            connection.commit()
+        return json.loads(row[0])
+    
+    def put(self, image_hash: str, config: str, results: list[dict]):
+        """儲存偵測結果"""
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO decode_cache VALUES (?, ?, ?, ?, ?)",
+                (image_hash, config, json.dumps(results, ensure_ascii=False), now, now),
+            )
+            connection.commit()
+    
+    def evict(self) -> int:
+        """
+        淘汰過期與超過數量上限的記錄
+        
+        Returns:
+            刪除的記錄數量
+        """
+        connection = self._connect()
+        cutoff = time.time() - self.max_age_days * 86400
+        deleted = connection.execute(
+            "DELETE FROM decode_cache WHERE accessed_at < ?", (cutoff,)
+        ).rowcount
+        deleted += connection.execute(
+            "DELETE FROM decode_cache WHERE rowid NOT IN ("
+            " SELECT rowid FROM decode_cache ORDER BY accessed_at DESC LIMIT ?)",
+            (self.max_entries,),
+        ).rowcount
+        connection.commit()
+        return deleted
+    
+    def close(self):
+        """關閉資料庫連線"""
+        if self._connection is not None and self._connection_pid == os.getpid():
+            self._connection.close()
+        self._connection = None
+        self._connection_pid = None
 
 
 class QRCodeConverter:
     """QR Code 轉換器類別"""
     
-    def __init__(self, input_folder: str = "input", output_folder: str = "output"):
+    def __init__(self, input_folder: str = "input", output_folder: str = "output",
+                 expected_count: int = 3, workers: int = 1, cache_path: str | None = None,
+                 incremental: bool = False, encoding_profile: str = "auto",
+                 recover_missing: bool = True, localize: bool = True, pyramid: bool = True,
+                 tile_size: int = 0, adaptive: bool = True, strategy_stats_path: str | None = None,
+                 time_budget: float = 0, pipeline: dict | None = None, recursive: bool = False,
+                 include: list[str] | None = None, exclude: list[str] | None = None,
+                 layout: str = "mirror", archive_path: str | None = None):
         """
         初始化轉換器
         
         Args:
             input_folder: 輸入資料夾路徑
             output_folder: 輸出資料夾路徑
+            expected_count: 每張圖片預期的 QR code 數量，偵測到這個數量後
+                即停止嘗試其他方法；設為 0 則一律執行所有偵測方法
+            workers: 平行處理的行程數量，1 為單一行程依序處理，
+                0 為依可用 CPU（含容器的 cgroup 配額）自動決定
+            cache_path: 解碼快取檔案路徑，None 表示不使用快取
+            incremental: 增量模式，依輸出清單只處理新增或變更的檔案；
+                False 時會先清空輸出資料夾再全部重新產生
+            encoding_profile: QR code 編碼設定檔（見 ENCODING_PROFILES）
+            recover_missing: QR code 數量不足時，是否依已找到的位置推測並解碼缺少的 QR code
+            localize: 是否先在縮小圖上定位 QR code，只對候選區域解碼
+            pyramid: 是否先在依圖片尺寸縮小的圖上解碼，仍有缺少才改用原尺寸
+            tile_size: 分塊模式的區塊邊長（像素）；圖片大於此尺寸時改為分塊偵測，
+                0 表示不分塊
+            adaptive: 是否依最近的成效統計調整偵測方法的順序
+            strategy_stats_path: 偵測方法成效統計的檔案路徑，None 表示不保存
+            time_budget: 每張圖片的偵測時限（秒），超過即停止並保留已找到的結果；0 表示不限制
+            pipeline: 處理管線各階段（load、decode、encode、write）的執行緒數量，
+                未指定的階段使用 DEFAULT_STAGE_THREADS，decode 未指定時使用 workers；
+                None 表示不使用管線，依 workers 以行程處理
+            recursive: 是否一併處理子資料夾中的圖片（輸出保留相同的子資料夾結構）
+            include: 只處理符合任一模式的圖片（glob，比對相對於輸入資料夾的路徑或檔名），None 表示全部
+            exclude: 略過符合任一模式的圖片與子資料夾（glob，比對方式同 include）
+            layout: 輸出檔案的資料夾配置（見 OUTPUT_LAYOUTS）；mirror 以外的配置
+                會將輸入的子資料夾名稱併入檔名，不同子資料夾中的同名檔案不會互相覆蓋
+            archive_path: 封存檔路徑（.zip 或 .tar），指定時所有輸出與輸出清單都串流寫入
+                這個封存檔，不寫入輸出資料夾，並一律處理所有檔案（不使用增量模式）
         """
+        if encoding_profile not in ENCODING_PROFILES:
+            raise ValueError(f"未知的編碼設定檔: {encoding_profile}")
+        if layout not in OUTPUT_LAYOUTS:
+            raise ValueError(f"未知的輸出配置: {layout}")
         self.input_folder = Path(input_folder)
+        self.encoding_profile = encoding_profile
         self.output_folder = Path(output_folder)
+        self.layout = layout
+        # 已建立的輸出子資料夾，避免每個輸出檔案都重複建立
+        self._output_dirs = set()
+        self.expected_count = expected_count
+        self.decode_cache = DecodeCache(cache_path) if cache_path else None
+        
+        # 依 CPU 配額決定行程數量與 OpenCV 執行緒數量（管線模式下為偵測階段的執行緒數量）；
+        # 分塊模式中每個 worker 分到的 CPU 改由分塊的執行緒使用，OpenCV 只用 1 個執行緒
+        if pipeline is not None:
+            workers = pipeline.get('decode', workers)
+        self.runtime = configure_runtime(workers, threads=0 if tile_size else 1)
+        self.workers = self.runtime['workers']
+        self.stage_threads = None
+        if pipeline is not None:
+            self.stage_threads = {**DEFAULT_STAGE_THREADS, **pipeline, 'decode': self.workers}
         
-        # 清空輸出資料夾
-        self._clear_output_folder()
+        # 偵測引擎（與網頁版本共用）
+        self.engine = QRCodeEngine(
+            expected_count=expected_count,
+            recover_missing=recover_missing,
+            localize=localize,
+            pyramid=pyramid,
+            tile_size=tile_size,
+            strategy_stats=StrategyStats(strategy_stats_path) if adaptive else None,
+            time_budget=time_budget,
+            threads=self.runtime['threads'],
+        )
         
-        # 確保輸出資料夾存在
-        self.output_folder.mkdir(parents=True, exist_ok=True)
+        self.incremental = incremental
+        self.archive = None
+        
+        if archive_path:
+            # 封存模式：輸出清單從空白開始，結束時寫入封存檔
+            self.archive = ArchiveSink(archive_path)
+            self.manifest = {'version': 1, 'config': self._manifest_config(), 'layout': layout, 'files': {}}
+        else:
+            # 完整模式先清空輸出資料夾
+            if not incremental:
+                self._clear_output_folder()
+            
+            # 確保輸出資料夾存在
+            self.output_folder.mkdir(parents=True, exist_ok=True)
+            
+            # 輸出清單：記錄每個輸入檔案的雜湊、修改時間與產生的輸出
+            self.manifest = self._load_manifest()
         
         # 支援的圖片格式
         self.supported_formats = {'.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff'}
+        
+        # 輸入檔案的掃描範圍
+        self.recursive = recursive
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
     
     def _clear_output_folder(self):
         """清空輸出資料夾"""
         if self.output_folder.exists():
             try:
-                # 刪除資料夾中的所有檔案
-                for item in self.output_folder.iterdir():
-                    if item.is_file():
-                        item.unlink()
-                        print(f"  🗑️  已刪除: {item.name}")
-                    elif item.is_dir():
-                        shutil.rmtree(item)
-                        print(f"  🗑️  已刪除資料夾: {item.name}")
+                # 刪除資料夾中的所有檔案（以 scandir 附帶的檔案類型判斷，不必逐一 stat）
+                removed = 0
+                with os.scandir(self.output_folder) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            shutil.rmtree(entry.path)
+                        else:
+                            os.unlink(entry.path)
+                        removed += 1
                 
-                if any(self.output_folder.iterdir()):
-                    print("  ✅ 輸出資料夾已清空")
+                if removed:
+                    print(f"  🗑️  已清空輸出資料夾（刪除 {removed} 個項目）")
             except Exception as e:
                 print(f"  ⚠️  清空輸出資料夾時發生錯誤: {e}")
     
+    def read_qrcode_details(self, image_path: Path, deadline: Deadline | None = None) -> list[dict]:
+        """
+        讀取 QR code 圖片並解碼內容，包含每個 QR code 的位置與偵測方法
+        
+        啟用解碼快取時，相同內容的圖片在相同偵測設定下會直接使用快取結果。
+        超過時限時停止偵測並返回已找到的部分結果（deadline.timed_out 為 True），
+        部分結果不會寫入快取。
+        
+        Args:
+            image_path: 圖片檔案路徑
+            deadline: 這張圖片的時限，None 表示依 time_budget 建立
+            
+        Returns:
+            依閱讀順序（由上而下、由左而右）排列的偵測結果列表（data、method、polygon），
+            如果失敗則返回空列表
+        """
+        item = {'path': image_path, 'log': [], 'deadline': deadline}
+        for name, stage in self._stages()[:2]:
+            self._run_stage(name, stage, item)
+        for line in item['log']:
+            print(line)
+        return item.get('qrcodes') or []
+    
     def read_qrcode(self, image_path: Path) -> list[str]:
         """
         讀取 QR code 圖片並解碼內容（支援多個 QR code）
         
+        依序嘗試多種偵測方法，一旦偵測到 expected_count 個不重複的
+        QR code 就停止，只有缺少 QR code 的圖片才會執行後面的方法。
+        
         Args:
             image_path: 圖片檔案路徑
             
         Returns:
             解碼後的文字內容列表，如果失敗則返回空列表
         """
-        try:
-            # 讀取圖片
-            image = cv2.imread(str(image_path))
-            if image is None:
-                print(f"❌ 無法讀取圖片: {image_path}")
-                return []
-            
-            detected_qrcodes = []
-            detected_data_set = set()  # 用於去重
-            
-            print(f"  📐 圖片尺寸: {image.shape[1]}x{image.shape[0]}")
-            
-            # 方法 1: 使用 pyzbar 在原圖上偵測（更準確）
-            if PYZBAR_AVAILABLE:
-                decoded_objects = decode(image)
-                print(f"  🔍 pyzbar 在原圖偵測到 {len(decoded_objects)} 個條碼")
-                for obj in decoded_objects:
-                    if obj.type == 'QRCODE':
-                        data = obj.data.decode('utf-8')
-                        if data and data not in detected_data_set:
-                            detected_qrcodes.append(data)
-                            detected_data_set.add(data)
-                            print(f"     → QR code: {data[:50]}...")
-            
-            # 方法 2: 轉灰階後用 pyzbar 再試一次
-            if PYZBAR_AVAILABLE:
-                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-                decoded_objects = decode(gray)
-                print(f"  🔍 pyzbar 在灰階圖偵測到 {len(decoded_objects)} 個條碼")
-                for obj in decoded_objects:
-                    if obj.type == 'QRCODE':
-                        data = obj.data.decode('utf-8')
-                        if data and data not in detected_data_set:
-                            detected_qrcodes.append(data)
-                            detected_data_set.add(data)
-                            print(f"     → QR code: {data[:50]}...")
-            
-            # 方法 3: 提高對比度後再試
-            if PYZBAR_AVAILABLE:
-                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-                # 使用 CLAHE (對比度限制自適應直方圖均衡化)
-                clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-                enhanced = clahe.apply(gray)
-                decoded_objects = decode(enhanced)
-                print(f"  🔍 pyzbar 在增強對比度圖偵測到 {len(decoded_objects)} 個條碼")
-                for obj in decoded_objects:
-                    if obj.type == 'QRCODE':
-                        data = obj.data.decode('utf-8')
-                        if data and data not in detected_data_set:
-                            detected_qrcodes.append(data)
-                            detected_data_set.add(data)
-                            print(f"     → QR code: {data[:50]}...")
-            
-            # 方法 4: 使用 OpenCV 的 detectAndDecodeMulti
-            detector = cv2.QRCodeDetector()
-            success, decoded_info, points, _ = detector.detectAndDecodeMulti(image)
-            
-            if success and decoded_info:
-                print(f"  🔍 OpenCV Multi 偵測到 {len(decoded_info)} 個 QR code")
-                for data in decoded_info:
-                    if data and data not in detected_data_set:
-                        detected_qrcodes.append(data)
-                        detected_data_set.add(data)
-                        print(f"     → QR code: {data[:50]}...")
-            
-            # 方法 5: 二值化後用 pyzbar
-            if PYZBAR_AVAILABLE:
-                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-                _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-                decoded_objects = decode(binary)
-                print(f"  🔍 pyzbar 在二值化圖偵測到 {len(decoded_objects)} 個條碼")
-                for obj in decoded_objects:
-                    if obj.type == 'QRCODE':
-                        data = obj.data.decode('utf-8')
-                        if data and data not in detected_data_set:
-                            detected_qrcodes.append(data)
-                            detected_data_set.add(data)
-                            print(f"     → QR code: {data[:50]}...")
-            
-            if detected_qrcodes:
-                print(f"  ✅ 總共成功偵測到 {len(detected_qrcodes)} 個不重複的 QR code")
-                return detected_qrcodes
-            
-            print(f"  ⚠️  嘗試所有方法後仍無法偵測到 QR code")
-            return []
-                
-        except Exception as e:
-            print(f"❌ 讀取 QR code 時發生錯誤 ({image_path}): {e}")
-            import traceback
-            traceback.print_exc()
-            return []
+        return [qr['data'] for qr in self.read_qrcode_details(image_path)]
     
     def convert_content(self, content: str) -> str:
         """
@@ -173,9 +579,7 @@ class QRCodeConverter:
         Returns:
             轉換後的內容
         """
-        # 替換 [CVS] 為 [MyCard]
-        converted = content.replace("[CVS]", "[MyCard]")
-        return converted
+        return convert_content(content)
     
     def generate_qrcode(self, content: str, output_path: Path) -> bool:
         """
@@ -189,23 +593,11 @@ class QRCodeConverter:
             是否成功生成
         """
         try:
-            # 建立 QR code 物件
-            qr = qrcode.QRCode(
-                version=1,  # 控制 QR code 的大小 (1-40)
-                error_correction=qrcode.constants.ERROR_CORRECT_H,  # 高容錯率
-                box_size=10,  # 每個格子的像素大小
-                border=4,  # 邊框寬度
-            )
-            
-            # 添加資料
-            qr.add_data(content)
-            qr.make(fit=True)
-            
-            # 建立圖片
-            img = qr.make_image(fill_color="black", back_color="white")
+            # 依編碼設定檔建立 QR code（高容錯率），直接由模組矩陣放大成圖片
+            img = generate_qrcode_image(content, self.encoding_profile)
             
-            # 儲存圖片
-            img.save(str(output_path))
+            # 儲存圖片（與 qrcode 套件相同，一律以 PNG 格式寫入）
+            img.save(str(output_path), format='PNG')
             
             return True
             
@@ -213,110 +605,780 @@ class QRCodeConverter:
             print(f"❌ 生成 QR code 時發生錯誤 ({output_path}): {e}")
             return False
     
-    def process_single_file(self, image_path: Path) -> int:
+    def _load_stage(self, item: dict):
+        """處理管線的讀取階段：讀取圖片檔案並查詢解碼快取"""
+        with open(item['path'], 'rb') as f:
+            stat = os.fstat(f.fileno())
+            item['image_bytes'] = f.read()
+        # 與讀取的內容對應的大小與修改時間，寫入清單時不必再 stat
+        item['size'] = stat.st_size
+        item['mtime_ns'] = stat.st_mtime_ns
+        item['sha256'] = DecodeCache.hash_bytes(item['image_bytes'])
+        if self.decode_cache is not None:
+            cached = self.decode_cache.get(item['sha256'], self.engine.detector_signature())
+            if cached is not None:
+                item['log'].append(f"  💾 使用快取結果（{len(cached)} 個 QR code）")
+                item['qrcodes'] = cached
+                item['cached'] = True
+    
+    def _decode_stage(self, item: dict):
         """
-        處理單一圖片檔案（支援多個 QR code）
+        處理管線的偵測階段：偵測沒有快取結果的圖片，完整的結果寫入解碼快取
         
-        Args:
-            image_path: 圖片檔案路徑
-            
-        Returns:
-            成功偵測到的 QR code 數量，失敗返回 0
+        超過時限時保留已找到的部分結果（不寫入快取）。
         """
-        print(f"\n處理中: {image_path.name}")
+        image_bytes = item.pop('image_bytes')
+        deadline = item.get('deadline') or Deadline(self.engine.time_budget)
+        item['timed_out'] = False
+        if item.get('qrcodes') is not None:
+            return
+        
+        result, log_lines = self.engine.decode_item(image_bytes, deadline=deadline)
+        item['log'] += log_lines
+        detected_qrcodes = item['qrcodes'] = result['qrcodes']
+        item['timed_out'] = result['timed_out']
+        if result['error']:
+            item['error'] = result['error']
+            item['log'].append(f"❌ 無法讀取圖片: {item['path']}")
+            return
         
-        # 讀取 QR code（可能有多個）
-        contents = self.read_qrcode(image_path)
-        if not contents:
-            return 0
+        if deadline.timed_out:
+            item['log'].append(
+                f"  ⏱️  超過時限 {deadline.seconds:g} 秒，停止偵測（保留已找到的 {len(detected_qrcodes)} 個）"
+            )
+        elif self.decode_cache is not None:
+            self.decode_cache.put(item['sha256'], self.engine.detector_signature(), detected_qrcodes)
         
-        print(f"  偵測到 {len(contents)} 個 QR code")
+        if detected_qrcodes:
+            item['log'].append(f"  ✅ 總共成功偵測到 {len(detected_qrcodes)} 個不重複的 QR code")
+        else:
+            item['log'].append(f"  ⚠️  嘗試所有方法後仍無法偵測到 QR code")
+    
+    def _output_filename(self, item: dict, idx: int, total: int) -> str:
+        """
+        輸出檔案名稱（相對於輸出資料夾，依 layout 決定所在的子資料夾）
+        
+        只有一個 QR code 時使用原始檔名，有多個時加上序號：filename_1.png, filename_2.png。
+        mirror 以外的配置將輸入的子資料夾名稱併入檔名，並加上子資料夾路徑的短雜湊
+        （例如 2024_01_e3d5f821_filename.png），名稱本身含有 _ 的不同路徑
+        （如 a_b/c.jpg 與 a/b_c.jpg）也不會對應到同一個輸出檔名。
+        """
+        image_path = item['path']
+        if total == 1:
+            filename = image_path.name
+        else:
+            filename = f"{image_path.stem}_{idx}{image_path.suffix}"
         
-        # 處理每個 QR code
-        success = True
+        relative_path = image_path.relative_to(self.input_folder)
+        if self.layout == 'mirror':
+            return (relative_path.parent / filename).as_posix()
+        if relative_path.parent.parts:
+            parent_digest = hashlib.sha1(relative_path.parent.as_posix().encode('utf-8')).hexdigest()
+            filename = "_".join(relative_path.parent.parts + (parent_digest[:PARENT_HASH_LENGTH], filename))
+        if self.layout == 'hash':
+            digest = hashlib.sha1(relative_path.as_posix().encode('utf-8')).hexdigest()
+            shards = [digest[level * 2:level * 2 + 2] for level in range(HASH_SHARD_LEVELS)]
+            return "/".join(shards + [filename])
+        if self.layout == 'date':
+            modified = datetime.fromtimestamp(item['mtime_ns'] / 1e9)
+            return f"{modified:%Y/%m/%d}/{filename}"
+        return filename
+    
+    def _encode_stage(self, item: dict):
+        """處理管線的生成階段：轉換每個 QR code 的內容並生成新的 QR code PNG"""
+        contents = [qr['data'] for qr in item['qrcodes']]
+        if contents:
+            item['log'].append(f"  偵測到 {len(contents)} 個 QR code")
+        
+        item['images'] = []
+        item['converted'] = []
         for idx, content in enumerate(contents, 1):
-            print(f"\n  QR code #{idx}:")
-            print(f"    原始內容: {content}")
+            log_lines = [f"\n  QR code #{idx}:", f"    原始內容: {content}"]
             
             # 轉換內容
             converted_content = self.convert_content(content)
-            print(f"    轉換內容: {converted_content}")
+            item['converted'].append(converted_content)
+            log_lines.append(f"    轉換內容: {converted_content}")
             
             # 檢查是否有變更
             if content == converted_content:
-                print(f"    ⚠️  內容沒有變更（未包含 [CVS]）")
-            
-            # 生成輸出檔案名稱
-            # 如果只有一個 QR code，使用原始檔名
-            # 如果有多個，加上序號：filename_1.png, filename_2.png
-            if len(contents) == 1:
-                output_filename = image_path.name
-            else:
-                stem = image_path.stem  # 檔名（不含副檔名）
-                suffix = image_path.suffix  # 副檔名
-                output_filename = f"{stem}_{idx}{suffix}"
+                log_lines.append(f"    ⚠️  內容沒有變更（未包含 [CVS]）")
             
+            output_filename = self._output_filename(item, idx, len(contents))
+            try:
+                # 與 generate_qrcode 相同，一律以 PNG 格式編碼
+                png_bytes = generate_qrcode_png(converted_content, self.encoding_profile)
+            except Exception as e:
+                log_lines.append(f"❌ 生成 QR code 時發生錯誤 ({self.output_folder / output_filename}): {e}")
+                png_bytes = None
+            item['images'].append((output_filename, png_bytes, log_lines))
+    
+    def _write_stage(self, item: dict):
+        """處理管線的寫入階段：將生成的 QR code 寫入輸出資料夾（封存模式下寫入封存檔）"""
+        item['outputs'] = []
+        item['failed'] = False
+        for output_filename, png_bytes, log_lines in item.pop('images'):
+            item['log'] += log_lines
+            if png_bytes is None:
+                item['failed'] = True
+                continue
             output_path = self.output_folder / output_filename
+            try:
+                if self.archive is not None:
+                    self.archive.write(output_filename, png_bytes)
+                elif output_path.parent != self.output_folder and output_path.parent not in self._output_dirs:
+                    output_path.parent.mkdir(parents=True, exist_ok=True)
+                    self._output_dirs.add(output_path.parent)
+                if self.archive is None:
+                    output_path.write_bytes(png_bytes)
+            except OSError as e:
+                item['log'].append(f"❌ 生成 QR code 時發生錯誤 ({output_path}): {e}")
+                item['failed'] = True
+                continue
+            item['log'].append(f"    ✅ 成功儲存到: {output_filename}")
+            item['outputs'].append(output_filename)
+    
+    def _stages(self) -> list[tuple[str, object]]:
+        """處理管線的各階段（名稱與處理函式），依序執行即為單一檔案的完整處理"""
+        return [
+            ('load', self._load_stage),
+            ('decode', self._decode_stage),
+            ('encode', self._encode_stage),
+            ('write', self._write_stage),
+        ]
+    
+    def _run_stage(self, name: str, stage, item: dict) -> dict:
+        """
+        執行一個處理階段並記錄耗時；前面的階段已發生錯誤或項目已有結果
+        （增量模式中未變更的檔案）時略過，發生錯誤時記錄在項目中
+        """
+        if item.get('error') is None and 'result' not in item:
+            start = time.perf_counter()
+            try:
+                stage(item)
+            except Exception as e:
+                item['error'] = str(e)
+                item['log'].append(f"❌ 處理時發生錯誤 ({item['path']}): {e}")
+                item['log'].append(traceback.format_exc().rstrip())
+            item.setdefault('timings', {})[name] = time.perf_counter() - start
+        return item
+    
+    def _file_result(self, item: dict) -> dict:
+        """
+        將處理完成的項目整理為處理結果
+        
+        Returns:
+            處理結果：
+            - path: 輸入檔案路徑
+            - status: "processed"（本次處理）或 "unchanged"（未變更，沿用上次的結果）
+            - count: 成功的 QR code 數量，失敗為 0
+            - payloads: 依閱讀順序排列的原始內容（未變更的檔案為 None）
+            - converted: 轉換後的內容（未變更的檔案為 None）
+            - outputs: 產生的輸出檔名列表（相對於輸出資料夾）
+            - output_paths: 產生的輸出檔案路徑列表（封存模式下為空列表，outputs 為封存檔中的路徑）
+            - methods: 最先找到各個 QR code 的偵測方法
+            - cached: 是否使用解碼快取的結果
+            - timed_out: 是否超過偵測時限
+            - error: 處理時發生的錯誤訊息，沒有錯誤為 None
+            - failed: 是否處理失敗（發生錯誤，或有 QR code 生成、寫入失敗）
+            - timings: 各處理階段（load、decode、encode、write）的耗時（秒）
+            - sha256、size、mtime_ns: 輸入檔案內容的雜湊、大小與修改時間，無法讀取時為 None
+        """
+        qrcodes = item.get('qrcodes') or []
+        failed = item.get('error') is not None or item.get('failed', False)
+        outputs = item.get('outputs', [])
+        return {
+            'path': item['path'],
+            'status': "processed",
+            'count': len(qrcodes) if qrcodes and not failed else 0,
+            'payloads': [qr['data'] for qr in qrcodes],
+            'converted': item.get('converted', []),
+            'outputs': outputs,
+            'output_paths': [] if self.archive is not None else [self.output_folder / name for name in outputs],
+            'methods': [qr['method'] for qr in qrcodes],
+            'cached': item.get('cached', False),
+            'timed_out': item.get('timed_out', False),
+            'error': item.get('error'),
+            'failed': failed,
+            'timings': item.get('timings', {}),
+            'sha256': item.get('sha256'),
+            'size': item.get('size'),
+            'mtime_ns': item.get('mtime_ns'),
+        }
+    
+    def _unchanged_result(self, image_path: Path, entry: dict) -> dict:
+        """未變更檔案的處理結果（依清單記錄，格式見 _file_result）"""
+        return {
+            'path': image_path,
+            'status': "unchanged",
+            'count': entry['count'],
+            'payloads': None,
+            'converted': None,
+            'outputs': entry['outputs'],
+            'output_paths': [self.output_folder / name for name in entry['outputs']],
+            'methods': [],
+            'cached': False,
+            'timed_out': entry.get('timed_out', False),
+            'error': None,
+            'failed': False,
+            'timings': {},
+            'sha256': entry['sha256'],
+            'size': entry['size'],
+            'mtime_ns': entry['mtime_ns'],
+        }
+    
+    def _new_item(self, image_path: Path) -> dict:
+        """建立處理管線中代表一個輸入檔案的項目（處理過程的訊息先收集在 log 中）"""
+        return {'path': image_path, 'log': [f"\n處理中: {self._manifest_key(image_path)}"]}
+    
+    def _process_file(self, image_path: Path) -> dict:
+        """
+        處理單一圖片檔案（支援多個 QR code），依序執行處理管線的各階段
+        
+        Args:
+            image_path: 圖片檔案路徑
             
-            # 生成新的 QR code
-            if self.generate_qrcode(converted_content, output_path):
-                print(f"    ✅ 成功儲存到: {output_filename}")
-            else:
-                success = False
+        Returns:
+            處理結果（格式見 _file_result）
+        """
+        item = self._new_item(image_path)
+        for name, stage in self._stages():
+            self._run_stage(name, stage, item)
+        for line in item['log']:
+            print(line)
+        return self._file_result(item)
+    
+    def process_single_file(self, image_path: Path) -> int:
+        """
+        處理單一圖片檔案（支援多個 QR code）
         
-        return len(contents) if success else 0
+        Args:
+            image_path: 圖片檔案路徑
+            
+        Returns:
+            成功偵測到的 QR code 數量，失敗返回 0
+        """
+        return self._process_file(image_path)['count']
     
-    def process_all(self) -> tuple[int, int, list]:
+    def _worker_copy(self) -> "QRCodeConverter":
+        """
+        傳給子行程的精簡副本
+        
+        只保留讀取、偵測、生成階段需要的設定（偵測引擎、解碼快取路徑、編碼設定檔、輸出配置），
+        不含輸出清單與封存檔，建立子行程時傳送一次，不必每個檔案都序列化整個轉換器。
+        """
+        worker = copy.copy(self)
+        worker.manifest = None
+        worker.archive = None
+        worker._output_dirs = set()
+        return worker
+    
+    def _prepare_file_captured(self, image_path: Path) -> tuple[dict, str]:
         """
-        處理所有圖片檔案
+        在子行程中執行寫入以外的處理階段，並收集其他輸出訊息
+        
+        寫入階段由主行程執行，封存模式下所有輸出都寫入主行程開啟的同一個封存檔。
         
         Returns:
-            (成功數量, 失敗數量, 不完整檔案列表) 的元組
+            (處理中的項目, 處理過程中其他的輸出訊息) 的元組
+        """
+        buffer = io.StringIO()
+        with contextlib.redirect_stdout(buffer):
+            item = self._new_item(image_path)
+            for name, stage in self._stages()[:-1]:
+                self._run_stage(name, stage, item)
+        return item, buffer.getvalue()
+    
+    def _iter_pipeline(self, image_files):
+        """
+        以處理管線處理所有檔案，依完成順序逐一產生每個檔案的處理結果
+        
+        讀取、偵測、生成、寫入各自以獨立的執行緒處理，磁碟讀寫與偵測同時進行，
+        記憶體用量只取決於佇列長度；各檔案的輸出訊息在完成時完整印出，不會互相交錯。
+        """
+        stages = [
+            (name, functools.partial(self._run_stage, name, stage), self.stage_threads[name])
+            for name, stage in self._stages()
+        ]
+        print("🚰 處理管線: " + " → ".join(f"{name} ×{self.stage_threads[name]}" for name in PIPELINE_STAGES))
+        items = ({'result': f} if isinstance(f, dict) else self._new_item(f) for f in image_files)
+        for item in StagedPipeline(stages).run(items):
+            if 'result' in item:
+                yield item['result']
+                continue
+            for line in item['log']:
+                print(line)
+            yield self._file_result(item)
+    
+    def _iter_results(self, image_files):
+        """
+        逐一產生每個檔案的處理結果
+        
+        輸入檔案可以是產生器，只在有空位時才取下一個檔案，掃描與處理同時進行。
+        輸入中也可以夾帶已完成的處理結果（dict，例如增量模式中未變更的檔案），
+        不經過處理階段，掃描到就產生，不必等待其他檔案處理完成。
+        workers 大於 1 時使用多行程平行處理，各檔案的輸出訊息
+        仍依輸入順序完整印出，不會互相交錯；使用處理管線時依完成順序產生。
+        """
+        if self.stage_threads is not None:
+            yield from self._iter_pipeline(image_files)
+            return
+        
+        if self.workers <= 1:
+            for image_file in image_files:
+                yield image_file if isinstance(image_file, dict) else self._process_file(image_file)
+            return
+        
+        print(f"🚀 使用 {self.workers} 個行程平行處理")
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(self.runtime['opencv_threads'], self._worker_copy()),
+        ) as executor:
+            # 同時送出的檔案數量限制為行程數量的兩倍
+            pending = collections.deque()
+            image_files = iter(image_files)
+            write_name, write_stage = self._stages()[-1]
+            while True:
+                for image_file in image_files:
+                    if isinstance(image_file, dict):
+                        yield image_file
+                        continue
+                    pending.append(executor.submit(_prepare_file_in_worker, image_file))
+                    if len(pending) >= self.workers * 2:
+                        break
+                if not pending:
+                    return
+                item, output = pending.popleft().result()
+                print(output, end="")
+                self._run_stage(write_name, write_stage, item)
+                for line in item['log']:
+                    print(line)
+                yield self._file_result(item)
+    
+    @property
+    def manifest_path(self) -> Path:
+        """輸出清單檔案路徑"""
+        return self.output_folder / MANIFEST_FILENAME
+    
+    def _manifest_config(self) -> str:
+        """輸出清單的設定識別字串（偵測設定加上編碼設定檔與輸出配置）"""
+        # mirror 以外的配置檔名含子資料夾路徑的雜湊，舊格式的輸出清單視為過期
+        layout = self.layout if self.layout == 'mirror' else f"{self.layout}+parent_hash"
+        return f"{self.engine.detector_signature()}|encoding={self.encoding_profile}|layout={layout}"
+    
+    def _load_manifest(self) -> dict:
+        """讀取輸出清單，不存在、無法解析或偵測設定不同時返回空清單"""
+        empty = {'version': 1, 'config': self._manifest_config(), 'layout': self.layout, 'files': {}}
+        if not self.manifest_path.exists():
+            return empty
+        try:
+            manifest = json.loads(self.manifest_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError) as e:
+            print(f"  ⚠️  無法讀取輸出清單，將重新處理所有檔案: {e}")
+            return empty
+        if manifest.get('config') != self._manifest_config():
+            # 偵測、編碼設定或輸出配置改變，舊的輸出全部視為過期（仍保留清單以便刪除舊輸出）
+            print("  ℹ️  偵測、編碼設定或輸出配置已變更，將重新處理所有檔案")
+            manifest['stale'] = True
+        return manifest
+    
+    def _save_manifest(self):
+        """
+        寫入輸出清單（先寫入暫存檔再取代，避免中斷時留下損毀的清單）
+        
+        清單以輸入檔案（相對於輸入資料夾的路徑）為鍵，outputs 為相對於輸出資料夾的輸出路徑，
+        下游程式依清單即可找到每個輸入檔案的輸出，不必列出輸出資料夾。
+        封存模式下清單寫入封存檔並關閉封存檔。
+        """
+        manifest = {
+            'version': 1,
+            'config': self._manifest_config(),
+            'layout': self.layout,
+            'files': self.manifest['files'],
+        }
+        if self.archive is not None:
+            self.archive.close(manifest)
+            self.manifest = manifest
+            return
+        temp_path = self.manifest_path.with_name(self.manifest_path.name + ".tmp")
+        temp_path.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding='utf-8')
+        os.replace(temp_path, self.manifest_path)
+        self.manifest = manifest
+    
+    def _manifest_key(self, image_path: Path) -> str:
+        """輸入檔案在清單中的鍵（相對於輸入資料夾的路徑）"""
+        return image_path.relative_to(self.input_folder).as_posix()
+    
+    def _is_unchanged(self, image_path: Path, entry: dict) -> bool:
+        """
+        檢查輸入檔案自上次處理後是否未變更且輸出仍存在
+        
+        大小與修改時間相同即視為未變更；修改時間不同時再比對內容雜湊，
+        內容相同則只更新清單中的修改時間。上次超過偵測時限或處理失敗（無法讀取、
+        生成或寫入失敗）的檔案一律重新處理，暫時性的錯誤下次執行會再試一次。
+        """
+        if self.manifest.get('stale') or entry.get('timed_out') or entry.get('failed'):
+            return False
+        if not all((self.output_folder / name).exists() for name in entry['outputs']):
+            return False
+        
+        # 掃描後才被刪除或輪替的檔案視為已變更，交由處理流程記錄這個檔案的錯誤
+        try:
+            stat = image_path.stat()
+        except OSError:
+            return False
+        if stat.st_size != entry['size']:
+            return False
+        if stat.st_mtime_ns == entry['mtime_ns']:
+            return True
+        try:
+            image_bytes = image_path.read_bytes()
+        except OSError:
+            return False
+        if DecodeCache.hash_bytes(image_bytes) == entry['sha256']:
+            entry['mtime_ns'] = stat.st_mtime_ns
+            return True
+        return False
+    
+    def _remove_outputs(self, entry: dict):
+        """刪除某個輸入檔案先前產生的輸出，以及因此變成空的子資料夾"""
+        for name in entry['outputs']:
+            output_path = self.output_folder / name
+            if output_path.exists():
+                output_path.unlink()
+            parent = output_path.parent
+            while parent != self.output_folder:
+                try:
+                    parent.rmdir()
+                except OSError:
+                    break  # 資料夾不是空的
+                self._output_dirs.discard(parent)
+                parent = parent.parent
+    
+    def _manifest_entry(self, result: dict) -> dict:
+        """
+        建立輸入檔案的清單記錄（沿用處理時讀取檔案當下的雜湊、大小與修改時間）
+        
+        無法讀取的檔案這些欄位為 None，並與生成或寫入失敗的檔案一樣標記為 failed，
+        下次執行時重新處理。
+        """
+        return {
+            'sha256': result['sha256'],
+            'size': result['size'],
+            'mtime_ns': result['mtime_ns'],
+            'count': result['count'],
+            'outputs': result['outputs'],
+            'timed_out': result.get('timed_out', False),
+            'failed': result['failed'],
+        }
+    
+    def _matches(self, relative_path: str, patterns: list[str]) -> bool:
+        """相對路徑（/ 分隔）或檔名是否符合任一 glob 模式"""
+        name = relative_path.rsplit("/", 1)[-1]
+        return any(fnmatch.fnmatch(relative_path, pattern) or fnmatch.fnmatch(name, pattern)
+                   for pattern in patterns)
+    
+    def iter_input_files(self):
+        """
+        以 os.scandir 串流掃描輸入資料夾，逐一產生符合條件的圖片檔案
+        
+        檔案與資料夾的判斷使用 scandir 附帶的檔案類型，一般檔案不需要額外的 stat；
+        不先建立完整的檔案清單，第一張圖片找到就能開始處理。
+        recursive 時依序深入子資料夾（不跟隨資料夾的符號連結，避免循環），
+        符合 exclude 的子資料夾整個略過。
+        """
+        stack = [(str(self.input_folder), "")]
+        while stack:
+            directory, prefix = stack.pop()
+            subdirectories = []
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        relative_path = prefix + entry.name
+                        if entry.is_dir(follow_symlinks=False):
+                            if self.recursive and not self._matches(relative_path, self.exclude):
+                                subdirectories.append((entry.path, relative_path + "/"))
+                        elif entry.is_file() \
+                                and os.path.splitext(entry.name)[1].lower() in self.supported_formats \
+                                and (not self.include or self._matches(relative_path, self.include)) \
+                                and not self._matches(relative_path, self.exclude):
+                            yield Path(entry.path)
+            except OSError as e:
+                print(f"  ⚠️  無法讀取資料夾 {directory}: {e}")
+            # 反向放入堆疊，子資料夾依掃描到的順序處理
+            stack.extend(reversed(subdirectories))
+    
+    def iter_process_all(self):
+        """
+        處理所有圖片檔案，每個輸入檔案完成即產生其處理結果
+        
+        輸入檔案邊掃描邊處理（見 iter_input_files）。
+        增量模式下只處理新增或變更的檔案，未變更的檔案直接產生沿用清單的結果，
+        掃描完整結束後，已刪除的輸入檔案其輸出也會一併移除。
+        輸出清單與偵測方法統計在結束時寫入；呼叫端提早停止迭代時，已完成的檔案也會寫入清單，
+        下次執行不必重新處理。封存模式下因例外（包含 Ctrl-C）中斷時捨棄未完成的封存檔，
+        不取代上次完成的封存檔。
+        
+        Yields:
+            每個輸入檔案的處理結果（格式見 _file_result）
         """
         # 檢查輸入資料夾是否存在
         if not self.input_folder.exists():
             print(f"❌ 輸入資料夾不存在: {self.input_folder}")
-            return 0, 0, []
+            return
         
-        # 取得所有圖片檔案
-        image_files = [
-            f for f in self.input_folder.iterdir()
-            if f.is_file() and f.suffix.lower() in self.supported_formats
-        ]
+        manifest_files = self.manifest['files']
+        seen_keys = set()
         
-        if not image_files:
-            print(f"⚠️  在 {self.input_folder} 中找不到任何圖片檔案")
-            return 0, 0, []
+        def pending_files():
+            # 邊掃描邊判斷：未變更的檔案直接產生沿用清單的結果，需要處理（新增或變更）的檔案
+            # 產生其路徑，變更的檔案先移除舊的輸出
+            for image_file in self.iter_input_files():
+                key = self._manifest_key(image_file)
+                seen_keys.add(key)
+                entry = manifest_files.get(key)
+                if entry is not None and self._is_unchanged(image_file, entry):
+                    yield self._unchanged_result(image_file, entry)
+                    continue
+                if entry is not None:
+                    self._remove_outputs(entry)
+                yield image_file
         
-        print(f"找到 {len(image_files)} 個圖片檔案")
+        scope = "（含子資料夾）" if self.recursive else ""
+        print(f"🔎 掃描 {self.input_folder}{scope}，找到的圖片立即開始處理")
         print("=" * 60)
         
-        # 處理每個檔案
+        strategy_stats = self.engine.strategy_stats
+        if strategy_stats is not None and strategy_stats.wins:
+            order = " → ".join(self.engine.strategy_names())
+            print(f"🧠 依最近 {len(strategy_stats.wins)} 筆統計的偵測方法順序: {order}")
+        
+        aborted = False
+        try:
+            # 處理每個檔案（依序處理時，統計會即時影響下一個檔案的方法順序）
+            unchanged_count = 0
+            for result in self._iter_results(pending_files()):
+                if result['status'] == "unchanged":
+                    unchanged_count += 1
+                    yield result
+                    continue
+                image_file = result['path']
+                manifest_files[self._manifest_key(image_file)] = self._manifest_entry(result)
+                if not result['cached']:
+                    # 快取結果的偵測方法已在當初偵測時記錄過
+                    self.engine.record(result['methods'])
+                yield result
+            
+            print()
+            if not seen_keys:
+                print(f"⚠️  在 {self.input_folder} 中找不到任何圖片檔案")
+            else:
+                print(f"🔎 共找到 {len(seen_keys)} 個圖片檔案")
+            if unchanged_count:
+                print(f"⏭️  {unchanged_count} 個檔案未變更，沿用上次的結果；"
+                      f"處理了 {len(seen_keys) - unchanged_count} 個")
+            
+            # 掃描完整結束後，移除已刪除輸入檔案的輸出（不在掃描範圍內但仍存在的檔案保留）
+            removed_keys = [
+                key for key in manifest_files
+                if key not in seen_keys and not (self.input_folder / key).exists()
+            ]
+            for key in removed_keys:
+                self._remove_outputs(manifest_files.pop(key))
+            if removed_keys:
+                print(f"🗑️  已移除 {len(removed_keys)} 個已刪除輸入檔案的輸出")
+        except GeneratorExit:
+            raise  # 呼叫端提早停止迭代，已完成的部分照常寫入
+        except BaseException:
+            aborted = self.archive is not None
+            raise
+        finally:
+            if aborted:
+                self.archive.abort()
+                print(f"\n⚠️  處理中斷，已捨棄未完成的封存檔（{self.archive.path} 維持不變）")
+            else:
+                self._save_manifest()
+            if strategy_stats is not None:
+                strategy_stats.save()
+            
+            if self.decode_cache is not None:
+                evicted = self.decode_cache.evict()
+                if evicted:
+                    print(f"\n💾 已從解碼快取淘汰 {evicted} 筆舊記錄")
+                self.decode_cache.close()
+    
+    def process_all(self) -> tuple[int, int, list]:
+        """
+        處理所有圖片檔案（逐一處理的流程見 iter_process_all）
+        
+        Returns:
+            (成功數量, 失敗數量, 不完整檔案列表) 的元組；
+            不完整檔案為 (相對於輸入資料夾的路徑, QR code 數量, 原因) 的元組，原因為 None 或「逾時」
+        """
         success_count = 0
         fail_count = 0
-        incomplete_files = []  # 記錄沒有偵測到 3 個 QR code 的檔案
+        incomplete_files = []  # 記錄沒有偵測到預期數量 QR code 的檔案
         
-        for image_file in image_files:
-            qr_count = self.process_single_file(image_file)
+        for result in self.iter_process_all():
+            qr_count = result['count']
             if qr_count > 0:
                 success_count += 1
-                # 如果偵測到的 QR code 數量不是 3 個，記錄下來
-                if qr_count != 3:
-                    incomplete_files.append((image_file.name, qr_count))
             else:
                 fail_count += 1
+            # 超過時限或偵測到的 QR code 數量不是預期數量，記錄下來
+            # （以清單的鍵記錄，含子資料夾時不同資料夾中的同名檔案可以區分）
+            if result['timed_out']:
+                incomplete_files.append((self._manifest_key(result['path']), qr_count, "逾時"))
+            elif qr_count > 0 and self.expected_count and qr_count != self.expected_count:
+                incomplete_files.append((self._manifest_key(result['path']), qr_count, None))
         
         return success_count, fail_count, incomplete_files
 
 
+def parse_stage_threads(spec: str) -> dict:
+    """
+    解析處理管線各階段的執行緒數量，例如 "load=2,decode=4"（"auto" 表示全部使用預設值）
+    
+    Raises:
+        argparse.ArgumentTypeError: 格式錯誤或階段名稱不存在
+    """
+    stage_threads = {}
+    if spec == "auto":
+        return stage_threads
+    for part in spec.split(","):
+        name, _, value = part.partition("=")
+        name = name.strip()
+        if name not in PIPELINE_STAGES or not value.strip().isdigit():
+            raise argparse.ArgumentTypeError(
+                f"無效的管線設定: {part}（格式為 階段=執行緒數量，階段為 {'、'.join(PIPELINE_STAGES)}）"
+            )
+        stage_threads[name] = int(value)
+    return stage_threads
+
+
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="將 QR code 內容從 [CVS] 轉換為 [MyCard]")
+    parser.add_argument("--input", default="input", help="輸入資料夾（預設: input）")
+    parser.add_argument("--output", default="output", help="輸出資料夾（預設: output）")
+    parser.add_argument(
+        "--recursive", action="store_true",
+        help="一併處理子資料夾中的圖片，輸出保留相同的子資料夾結構"
+    )
+    parser.add_argument(
+        "--layout", default="mirror", choices=list(OUTPUT_LAYOUTS),
+        help="輸出檔案的資料夾配置：" + "；".join(
+            f"{name} = {description}" for name, description in OUTPUT_LAYOUTS.items()
+        ) + "（mirror 以外會將子資料夾名稱併入檔名，預設: mirror）"
+    )
+    parser.add_argument(
+        "--archive", metavar="PATH",
+        help="將所有輸出與輸出清單串流寫入單一封存檔（.zip 或 .tar，PNG 不再壓縮），不寫入輸出資料夾；"
+             "一律處理所有檔案"
+    )
+    parser.add_argument(
+        "--include", action="append", metavar="GLOB",
+        help="只處理符合模式的圖片，比對相對於輸入資料夾的路徑或檔名（可重複指定，例如 --include '2024/*'）"
+    )
+    parser.add_argument(
+        "--exclude", action="append", metavar="GLOB",
+        help="略過符合模式的圖片與子資料夾，比對方式同 --include（可重複指定）"
+    )
+    parser.add_argument(
+        "--expected-count", type=int, default=3,
+        help="每張圖片預期的 QR code 數量，達到後即停止偵測（0 表示執行所有方法，預設: 3）"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="平行處理的行程數量（0 表示依可用 CPU 與容器配額自動決定，預設: 1）"
+    )
+    parser.add_argument(
+        "--cache", default=".qrcode_cache.sqlite",
+        help="解碼快取檔案路徑，重新執行時相同圖片不再重新偵測（預設: .qrcode_cache.sqlite）"
+    )
+    parser.add_argument("--no-cache", action="store_true", help="不使用解碼快取")
+    parser.add_argument(
+        "--profile", default="auto", choices=list(ENCODING_PROFILES),
+        help="QR code 編碼設定檔：" + "；".join(
+            f"{name} = {settings['description']}" for name, settings in ENCODING_PROFILES.items()
+        ) + "（預設: auto）"
+    )
+    parser.add_argument(
+        "--no-recovery", action="store_true",
+        help="停用缺少 QR code 時依已知位置推測並局部解碼的回復步驟"
+    )
+    parser.add_argument(
+        "--no-pyramid", action="store_true",
+        help="停用金字塔解碼，不先在縮小圖上嘗試偵測"
+    )
+    parser.add_argument(
+        "--tile-size", type=int, default=0,
+        help="分塊模式的區塊邊長（像素），大於此尺寸的圖片改為分塊偵測並處理所有區塊，適用大張掃描圖；"
+             "一張圖有多張卡片時請以 --expected-count 指定總數或 0（預設: 0 不分塊）"
+    )
+    parser.add_argument(
+        "--strategy-stats", default=".qrcode_strategy_stats.json",
+        help="偵測方法成效統計檔案，依最近找到 QR code 的次數調整方法順序（預設: .qrcode_strategy_stats.json）"
+    )
+    parser.add_argument(
+        "--no-adaptive", action="store_true",
+        help="停用偵測方法順序調整，一律使用預設順序"
+    )
+    parser.add_argument(
+        "--time-budget", type=float, default=0,
+        help="每張圖片的偵測時限（秒），超過即停止並保留已找到的結果，列入不完整報告（預設: 0 不限制）"
+    )
+    parser.add_argument(
+        "--pipeline", nargs="?", const="auto", default=None, type=parse_stage_threads, metavar="STAGES",
+        help="使用處理管線，讀取、偵測、生成、寫入以有界佇列串接並各自以執行緒同時處理；"
+             "可指定各階段執行緒數量，例如 load=2,decode=4,encode=1,write=2"
+             "（預設 load=2,encode=1,write=2，decode 為 --workers 的數量）"
+    )
+    parser.add_argument(
+        "--no-localize", action="store_true",
+        help="停用定位步驟，直接對整張圖片執行偵測"
+    )
+    parser.add_argument(
+        "--full", action="store_true",
+        help="清空輸出資料夾並重新處理所有檔案（預設為增量模式，只處理新增或變更的檔案）"
+    )
+    return parser.parse_args()
+
+
 def main():
     """主程式"""
+    args = parse_args()
+    
     print("QR Code 轉換程式")
     print("將 [CVS] 轉換為 [MyCard]")
     print("=" * 60)
     
     # 建立轉換器
-    converter = QRCodeConverter(input_folder="input", output_folder="output")
+    converter = QRCodeConverter(
+        input_folder=args.input,
+        output_folder=args.output,
+        expected_count=args.expected_count,
+        workers=args.workers,
+        cache_path=None if args.no_cache else args.cache,
+        incremental=not args.full,
+        encoding_profile=args.profile,
+        recover_missing=not args.no_recovery,
+        localize=not args.no_localize,
+        pyramid=not args.no_pyramid,
+        tile_size=args.tile_size,
+        adaptive=not args.no_adaptive,
+        strategy_stats_path=args.strategy_stats,
+        time_budget=args.time_budget,
+        pipeline=args.pipeline,
+        recursive=args.recursive,
+        include=args.include,
+        exclude=args.exclude,
+        layout=args.layout,
+        archive_path=args.archive,
+    )
+    print(f"⚙️  執行環境: {format_runtime(converter.runtime)}")
+    expected = converter.expected_count
     
     # 處理所有檔案
     success, fail, incomplete_files = converter.process_all()
@@ -330,7 +1392,7 @@ def main():
     # 顯示並寫入沒有偵測到 3 個 QR code 的檔案
     if incomplete_files:
         print("\n" + "=" * 60)
-        print("⚠️  以下檔案沒有偵測到 3 個 QR code：")
+        print(f"⚠️  以下檔案沒有偵測到 {expected} 個 QR code 或超過偵測時限：")
         
         # 寫入報告檔案
         report_path = Path("incomplete_files_report.txt")
@@ -345,23 +1407,33 @@ def main():
             f.write("=" * 60 + "\n")
             f.write("偵測不完整的檔案列表：\n\n")
             
-            for filename, count in incomplete_files:
+            for filename, count, reason in incomplete_files:
                 msg = f"   • {filename}: 偵測到 {count} 個 QR code"
+                if reason:
+                    msg += f"（{reason}）"
                 print(msg)
                 f.write(f"{filename}\n")
                 f.write(f"  偵測到: {count} 個 QR code\n")
-                f.write(f"  缺少: {3 - count} 個 QR code\n\n")
+                if expected:
+                    f.write(f"  缺少: {expected - count} 個 QR code\n")
+                if reason:
+                    f.write(f"  原因: {reason}\n")
+                f.write("\n")
         
         print(f"\n📄 報告已儲存到: {report_path.absolute()}")
     else:
-        print("\n✅ 所有檔案都成功偵測到 3 個 QR code！")
+        if expected:
+            print(f"\n✅ 所有檔案都成功偵測到 {expected} 個 QR code！")
         # 如果所有檔案都完整，刪除舊的報告檔案（如果存在）
         report_path = Path("incomplete_files_report.txt")
         if report_path.exists():
             report_path.unlink()
             print("📄 已刪除舊的報告檔案")
     
-    print(f"\n輸出資料夾: {converter.output_folder.absolute()}")
+    if converter.archive is not None:
+        print(f"\n📦 封存檔: {converter.archive.path.absolute()}（{converter.archive.count} 個檔案）")
+    else:
+        print(f"\n輸出資料夾: {converter.output_folder.absolute()}")
 
 
 if __name__ == "__main__":
@@ -91,6 +91,7 @@ def prepare_briefcase_structure():
     # 複製主程式並重新命名為 __main__.py
     import shutil
     shutil.copy('qrcode_converter.py', app_folder / '__main__.py')
+    shutil.copy('qr_engine.py', app_folder / 'qr_engine.py')
     
     # 建立 __init__.py
     (app_folder / '__init__.py').write_text('"""QRCode Converter Application"""\n')
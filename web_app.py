@@ -6,18 +6,22 @@ QR Code 轉換程式 - Web 版本
 """
 
 import streamlit as st
-import cv2
-import qrcode
 import io
+import hashlib
 from PIL import Image
 import zipfile
 from datetime import datetime
 
-try:
-    from pyzbar.pyzbar import decode
-    PYZBAR_AVAILABLE = True
-except ImportError:
-    PYZBAR_AVAILABLE = False
+from qr_engine import (
+    ENCODING_PROFILES,
+    PYZBAR_AVAILABLE,
+    Deadline,
+    QRCodeEngine,
+    StrategyStats,
+    configure_runtime,
+    convert_qrcodes,
+    format_runtime,
+)
 
 # 設定頁面
 st.set_page_config(
@@ -58,123 +62,261 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
-def read_qrcode_from_image(image):
-    """從圖片讀取 QR code"""
-    import numpy as np
+# 批次偵測同時處理的圖片數量，0 表示依可用 CPU（含容器配額）決定
+BATCH_WORKERS = 0
+
+
+@st.cache_resource
+def get_runtime():
+    """
+    依容器 CPU 配額設定批次偵測的執行緒數量與 OpenCV 執行緒數量（每個伺服器行程只執行一次）
     
-    # 轉換為 numpy array
-    img_array = np.array(image)
+    批次執行緒數量 × OpenCV 執行緒數量不超過可用 CPU，兩層平行化不會相乘。
+    """
+    runtime = configure_runtime(workers=BATCH_WORKERS)
+    print(f"⚙️  執行環境: {format_runtime(runtime)}")
+    return runtime
+
+
+# 偵測方法成效統計檔案（與命令列版本的預設相同），新的伺服器行程從學到的順序開始
+STRATEGY_STATS_PATH = ".qrcode_strategy_stats.json"
+# 每偵測幾張圖片就寫回一次統計檔案
+STRATEGY_STATS_SAVE_INTERVAL = 20
+
+
+@st.cache_resource
+def get_engine():
+    """
+    取得與命令列版本相同設定的偵測引擎（每個伺服器行程共用一個）
     
-    detected_qrcodes = []
-    detected_data_set = set()
+    偵測方法的成效統計由所有連線共同累積，並定期寫回 STRATEGY_STATS_PATH。
+    """
+    return QRCodeEngine(
+        expected_count=3,
+        strategy_stats=StrategyStats(STRATEGY_STATS_PATH, autosave=STRATEGY_STATS_SAVE_INTERVAL),
+        threads=get_runtime()['workers'],
+        verbose=False,
+    )
+
+
+def read_qrcode_from_bytes(image_bytes, deadline=None):
+    """
+    從圖片檔案內容讀取 QR code，依閱讀順序（由上而下、由左而右）返回內容列表
     
-    # 方法 1: 使用 pyzbar（原圖）
-    if PYZBAR_AVAILABLE:
-        decoded_objects = decode(img_array)
-        for obj in decoded_objects:
-            if obj.type == 'QRCODE':
-                data = obj.data.decode('utf-8')
-                if data and data not in detected_data_set:
-                    detected_qrcodes.append(data)
-                    detected_data_set.add(data)
+    超過 deadline 時返回已找到的部分結果（deadline.timed_out 為 True）。
     
-    # 方法 2: 使用 pyzbar（灰階）
-    if PYZBAR_AVAILABLE and len(detected_qrcodes) < 3:
-        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-        decoded_objects = decode(gray)
-        for obj in decoded_objects:
-            if obj.type == 'QRCODE':
-                data = obj.data.decode('utf-8')
-                if data and data not in detected_data_set:
-                    detected_qrcodes.append(data)
-                    detected_data_set.add(data)
+    Raises:
+        ValueError: 無法解碼圖片
+    """
+    engine = get_engine()
+    detected_qrcodes = engine.decode(image_bytes, deadline)
+    engine.record([qr['method'] for qr in detected_qrcodes])
+    return [qr['data'] for qr in detected_qrcodes]
+
+
+# 偵測與生成結果快取：Streamlit 每次互動都會重新執行整個腳本，
+# 相同內容的圖片直接使用快取結果，不再重新偵測
+RESULT_CACHE_MAX_ENTRIES = 500
+RESULT_CACHE_TTL_SECONDS = 3600
+
+# 每張圖片的偵測時限（秒），避免單一張難以辨識的圖片拖住整批處理
+DEFAULT_TIME_BUDGET_SECONDS = 10
+
+
+class DecodeTimeout(Exception):
+    """偵測超過時限（附帶已完成的部分結果；例外不會被 st.cache_data 快取）"""
     
-    # 方法 3: 使用 pyzbar（增強對比度）
-    if PYZBAR_AVAILABLE and len(detected_qrcodes) < 3:
-        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-        enhanced = clahe.apply(gray)
-        decoded_objects = decode(enhanced)
-        for obj in decoded_objects:
-            if obj.type == 'QRCODE':
-                data = obj.data.decode('utf-8')
-                if data and data not in detected_data_set:
-                    detected_qrcodes.append(data)
-                    detected_data_set.add(data)
+    def __init__(self, results, seconds):
+        super().__init__(f"超過偵測時限 {seconds:g} 秒")
+        self.results = results
+
+
+class CacheMiss(Exception):
+    """只查詢快取時沒有這張圖片的結果（例外不會被 st.cache_data 快取）"""
+
+
+@st.cache_data(max_entries=RESULT_CACHE_MAX_ENTRIES, ttl=RESULT_CACHE_TTL_SECONDS, show_spinner=False)
+def _process_image_bytes(content_hash, encoding_profile, _image_bytes, _time_budget=0, _decoded=None):
+    """
+    偵測並轉換圖片中的 QR code（以內容雜湊 content_hash 與編碼設定檔為快取鍵）
+    
+    超過時限 _time_budget（秒）時拋出 DecodeTimeout，部分結果不會被快取。
+    _decoded 為批次偵測已完成的結果（QRCodeEngine.decode_item 的格式）時不再偵測，
+    只轉換並寫入快取；_image_bytes 與 _decoded 都為 None 時只查詢快取，
+    沒有快取結果則拋出 CacheMiss。
     
-    # 方法 4: 使用 pyzbar（二值化）
-    if PYZBAR_AVAILABLE and len(detected_qrcodes) < 3:
-        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        decoded_objects = decode(binary)
-        for obj in decoded_objects:
-            if obj.type == 'QRCODE':
-                data = obj.data.decode('utf-8')
-                if data and data not in detected_data_set:
-                    detected_qrcodes.append(data)
-                    detected_data_set.add(data)
+    Returns:
+        (結果列表, 錯誤訊息) 的元組
+    """
+    # 讀取 QR code
+    if _decoded is not None:
+        if _decoded['error']:
+            return None, _decoded['error']
+        contents = [qr['data'] for qr in _decoded['qrcodes']]
+        timed_out = _decoded['timed_out']
+    elif _image_bytes is None:
+        raise CacheMiss(content_hash)
+    else:
+        deadline = Deadline(_time_budget)
+        try:
+            contents = read_qrcode_from_bytes(_image_bytes, deadline)
+        except ValueError:
+            return None, "無法讀取圖片"
+        timed_out = deadline.timed_out
     
-    # 方法 5: 使用 OpenCV（作為備用）
-    if len(detected_qrcodes) == 0:
-        detector = cv2.QRCodeDetector()
-        # 轉換為 BGR 格式（OpenCV 使用的格式）
-        img_bgr = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-        success, decoded_info, points, _ = detector.detectAndDecodeMulti(img_bgr)
-        if success and decoded_info:
-            for data in decoded_info:
-                if data and data not in detected_data_set:
-                    detected_qrcodes.append(data)
-                    detected_data_set.add(data)
+    if not contents and not timed_out:
+        return None, "無法偵測到 QR code"
+    
+    # 轉換並生成新的 QR code
+    results = convert_qrcodes(contents, encoding_profile)
     
-    return detected_qrcodes
+    if timed_out:
+        raise DecodeTimeout(results, _time_budget)
+    return results, None
 
 
-def convert_content(content):
-    """轉換內容"""
-    return content.replace("[CVS]", "[MyCard]")
+# 每個連線保留的逾時部分結果數量上限（超過時先移除最早的）
+PARTIAL_RESULTS_MAX_ENTRIES = 50
 
 
-def generate_qrcode(content):
-    """生成 QR code"""
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_H,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(content)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    return img
+def _partial_results() -> dict:
+    """
+    目前連線中逾時圖片的部分結果，以 (內容雜湊, 編碼設定檔, 時限) 為鍵
+    
+    部分結果不寫入 st.cache_data（換個時限或設定可能找到更多），
+    但保存在 session_state 中，同一連線的重新執行（例如點擊下載按鈕）不必再跑一次完整的時限。
+    """
+    return st.session_state.setdefault('partial_results', {})
+
+
+def _remember_partial(key: tuple, timeout: DecodeTimeout) -> tuple:
+    """保存逾時的部分結果，返回 (結果列表, 錯誤訊息)"""
+    partial_results = _partial_results()
+    partial_results[key] = timeout.results or None, f"{timeout}（部分結果）"
+    while len(partial_results) > PARTIAL_RESULTS_MAX_ENTRIES:
+        partial_results.pop(next(iter(partial_results)))
+    return partial_results[key]
 
 
-def process_image(uploaded_file):
-    """處理單個圖片"""
-    image = Image.open(uploaded_file)
+def process_image(uploaded_file, encoding_profile="auto", time_budget=DEFAULT_TIME_BUDGET_SECONDS):
+    """
+    處理單個圖片
     
-    # 讀取 QR code
-    contents = read_qrcode_from_image(image)
+    超過時限時返回已找到的部分結果，並以錯誤訊息說明逾時；
+    部分結果保存在這個連線中，重新執行時直接沿用。
+    """
+    image_bytes = uploaded_file.getvalue()
+    content_hash = hashlib.sha256(image_bytes).hexdigest()
+    partial_key = (content_hash, encoding_profile, time_budget)
+    if partial_key in _partial_results():
+        results, error = _partial_results()[partial_key]
+    else:
+        try:
+            results, error = _process_image_bytes(content_hash, encoding_profile, image_bytes, time_budget)
+        except DecodeTimeout as timeout:
+            results, error = _remember_partial(partial_key, timeout)
+    image = Image.open(io.BytesIO(image_bytes))
+    return results, image, error
+
+
+def process_batch(uploaded_files, encoding_profile="auto", time_budget=DEFAULT_TIME_BUDGET_SECONDS):
+    """
+    以引擎的批次偵測處理多張圖片，依上傳順序逐一產生每張圖片的結果
     
-    if not contents:
-        return None, image, "無法偵測到 QR code"
+    與單張處理共用 _process_image_bytes 的快取與這個連線的逾時部分結果：
+    已有結果的圖片直接使用，其餘圖片同時偵測（偵測器等物件在整批圖片間沿用），結果再寫入快取。
     
-    # 轉換並生成新的 QR code
-    results = []
-    for idx, content in enumerate(contents, 1):
-        converted = convert_content(content)
-        new_qr = generate_qrcode(converted)
-        results.append({
-            'index': idx,
-            'original': content,
-            'converted': converted,
-            'qr_image': new_qr
-        })
+    Yields:
+        (檔案, 結果列表, 錯誤訊息) 的元組；逾時的圖片結果列表為部分結果
+    """
+    content_hashes = [hashlib.sha256(file.getvalue()).hexdigest() for file in uploaded_files]
+    partial_results = _partial_results()
+    cached_results = {}
+    for content_hash in content_hashes:
+        partial_key = (content_hash, encoding_profile, time_budget)
+        if partial_key in partial_results:
+            cached_results[content_hash] = partial_results[partial_key]
+            continue
+        try:
+            cached_results[content_hash] = _process_image_bytes(content_hash, encoding_profile, None)
+        except CacheMiss:
+            pass
     
-    return results, image, None
+    # 同一批中內容相同的圖片只偵測一次
+    misses = list({
+        content_hash: file
+        for file, content_hash in zip(uploaded_files, content_hashes)
+        if content_hash not in cached_results
+    }.items())
+    images = (file.getvalue() for _, file in misses)
+    decoded_images = zip(misses, get_engine().iter_decode_batch(images, time_budget=time_budget))
+    
+    for file, content_hash in zip(uploaded_files, content_hashes):
+        while content_hash not in cached_results:
+            (miss_hash, miss_file), decoded = next(decoded_images)
+            try:
+                cached_results[miss_hash] = _process_image_bytes(
+                    miss_hash, encoding_profile, miss_file.getvalue(), time_budget, _decoded=decoded
+                )
+            except DecodeTimeout as timeout:
+                cached_results[miss_hash] = _remember_partial((miss_hash, encoding_profile, time_budget), timeout)
+        results, error = cached_results[content_hash]
+        yield file, results, error
+
+
+def show_batch_results(total_files, all_results, incomplete_files, zip_bytes, zip_name):
+    """顯示批次處理結果"""
+    # 顯示統計
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("總圖片數", total_files)
+    with col2:
+        st.metric("成功處理", len(all_results))
+    with col3:
+        total_qrcodes = sum(len(r['results']) for r in all_results)
+        st.metric("總 QR code", total_qrcodes)
+    
+    # 顯示不完整檔案
+    if incomplete_files:
+        st.warning(f"⚠️ {len(incomplete_files)} 個檔案偵測不完整")
+        with st.expander("查看詳情"):
+            for filename, count, error in incomplete_files:
+                if error and count:
+                    st.text(f"⏱️ {filename}: 偵測到 {count} 個 QR code，{error}")
+                elif error:
+                    st.text(f"❌ {filename}: {error}")
+                else:
+                    st.text(f"⚠️ {filename}: 偵測到 {count} 個 QR code（預期 3 個）")
+    else:
+        st.success("✅ 所有檔案都成功處理！")
+    
+    # ZIP 下載
+    if all_results:
+        st.divider()
+        st.subheader("📦 下載所有結果")
+        
+        st.download_button(
+            label="⬇️ 下載所有 QR Code (ZIP)",
+            data=zip_bytes,
+            file_name=zip_name,
+            mime="application/zip"
+        )
+    
+    # 顯示詳細結果
+    with st.expander("📋 查看詳細結果"):
+        for file_result in all_results:
+            st.markdown(f"### {file_result['filename']}")
+            for qr_result in file_result['results']:
+                col1, col2 = st.columns([3, 1])
+                with col1:
+                    st.text(f"QR #{qr_result['index']}: {qr_result['original']} → {qr_result['converted']}")
+                with col2:
+                    st.image(qr_result['png_bytes'], width=100)
 
 
 def main():
     """主程式"""
+    runtime = get_runtime()
     
     # 標題
     st.title("🔄 QR Code 轉換器")
@@ -207,6 +349,28 @@ def main():
         else:
             st.warning("⚠️ 使用 OpenCV（標準精度）")
         
+        cpu_limit = runtime['cpu_limit']
+        limit_text = f"{cpu_limit:g}" if cpu_limit is not None else "無限制"
+        st.caption(
+            f"⚙️ CPU 配額：{limit_text}｜可用 CPU：{runtime['cpus']}｜"
+            f"批次執行緒：{runtime['workers']}｜OpenCV 執行緒：{runtime['opencv_threads']}"
+        )
+        
+        encoding_profile = st.selectbox(
+            "🧩 編碼設定檔",
+            options=list(ENCODING_PROFILES),
+            format_func=lambda name: f"{name}：{ENCODING_PROFILES[name]['description']}",
+            help="固定 QR code 版本與遮罩可省去每次的版本搜尋與遮罩評分",
+        )
+        
+        time_budget = st.number_input(
+            "⏱️ 每張圖片時限（秒）",
+            min_value=0.0,
+            value=float(DEFAULT_TIME_BUDGET_SECONDS),
+            step=1.0,
+            help="超過時限即停止偵測並保留已找到的結果，0 表示不限制",
+        )
+        
         st.info("""
         💡 **提示**
         
@@ -236,11 +400,14 @@ def main():
                 st.image(image, width='stretch')
             
             with st.spinner("🔍 正在偵測和轉換 QR code..."):
-                results, original_image, error = process_image(uploaded_file)
+                results, original_image, error = process_image(uploaded_file, encoding_profile, time_budget)
             
-            if error:
+            if error and results:
+                st.warning(f"⏱️ {error}")
+            elif error:
                 st.error(f"❌ {error}")
-            elif results:
+            
+            if results:
                 with col2:
                     st.subheader("📊 處理結果")
                     st.success(f"✅ 偵測到 {len(results)} 個 QR code")
@@ -256,20 +423,12 @@ def main():
                         else:
                             st.warning("⚠️ 內容未變更（未包含 [CVS]）")
                         
-                        # 轉換 PIL Image 為 bytes 以便顯示
-                        img_bytes = io.BytesIO()
-                        result['qr_image'].save(img_bytes, format='PNG')
-                        img_bytes.seek(0)
-                        
                         # 顯示 QR code
-                        st.image(img_bytes, width=250)
-                        
-                        # 重置 BytesIO 以便下載
-                        img_bytes.seek(0)
+                        st.image(result['png_bytes'], width=250)
                         
                         st.download_button(
                             label=f"⬇️ 下載 QR Code #{result['index']}",
-                            data=img_bytes,
+                            data=result['png_bytes'],
                             file_name=f"qrcode_{result['index']}.png",
                             mime="image/png",
                             key=f"download_{result['index']}"
@@ -287,6 +446,9 @@ def main():
         if uploaded_files:
             st.info(f"📁 已上傳 {len(uploaded_files)} 張圖片")
             
+            # 以上傳檔案識別這一批，結果存在 session 中，點擊下載按鈕重新執行時不會消失
+            batch_key = (encoding_profile, time_budget, *(file.file_id for file in uploaded_files))
+            
             if st.button("🚀 開始批次處理", type="primary"):
                 progress_bar = st.progress(0)
                 status_text = st.empty()
@@ -294,91 +456,56 @@ def main():
                 all_results = []
                 incomplete_files = []
                 
-                for idx, file in enumerate(uploaded_files):
-                    status_text.text(f"處理中: {file.name} ({idx + 1}/{len(uploaded_files)})")
-                    
-                    results, _, error = process_image(file)
+                status_text.text(f"處理中: {len(uploaded_files)} 張圖片")
+                batch = process_batch(uploaded_files, encoding_profile, time_budget)
+                for idx, (file, results, error) in enumerate(batch):
+                    status_text.text(f"已完成: {file.name} ({idx + 1}/{len(uploaded_files)})")
                     
-                    if error:
-                        incomplete_files.append((file.name, 0, error))
-                    elif results:
+                    # 逾時的檔案保留部分結果，同時列入不完整清單
+                    if results:
                         all_results.append({
                             'filename': file.name,
                             'results': results
                         })
-                        if len(results) != 3:
-                            incomplete_files.append((file.name, len(results), None))
+                    if error:
+                        incomplete_files.append((file.name, len(results or []), error))
+                    elif len(results) != 3:
+                        incomplete_files.append((file.name, len(results), None))
                     
                     progress_bar.progress((idx + 1) / len(uploaded_files))
                 
                 status_text.empty()
                 progress_bar.empty()
                 
-                # 顯示統計
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("總圖片數", len(uploaded_files))
-                with col2:
-                    st.metric("成功處理", len(all_results))
-                with col3:
-                    total_qrcodes = sum(len(r['results']) for r in all_results)
-                    st.metric("總 QR code", total_qrcodes)
-                
-                # 顯示不完整檔案
-                if incomplete_files:
-                    st.warning(f"⚠️ {len(incomplete_files)} 個檔案偵測不完整")
-                    with st.expander("查看詳情"):
-                        for filename, count, error in incomplete_files:
-                            if error:
-                                st.text(f"❌ {filename}: {error}")
-                            else:
-                                st.text(f"⚠️ {filename}: 偵測到 {count} 個 QR code（預期 3 個）")
-                else:
-                    st.success("✅ 所有檔案都成功處理！")
-                
-                # 建立 ZIP 下載
-                if all_results:
-                    st.divider()
-                    st.subheader("📦 下載所有結果")
-                    
-                    zip_buffer = io.BytesIO()
-                    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                        for file_result in all_results:
-                            for qr_result in file_result['results']:
-                                img_bytes = io.BytesIO()
-                                qr_result['qr_image'].save(img_bytes, format='PNG')
-                                img_bytes.seek(0)
-                                
-                                if len(file_result['results']) == 1:
-                                    filename = f"{file_result['filename'].rsplit('.', 1)[0]}.png"
-                                else:
-                                    filename = f"{file_result['filename'].rsplit('.', 1)[0]}_{qr_result['index']}.png"
-                                
-                                zip_file.writestr(filename, img_bytes.getvalue())
-                    
-                    zip_buffer.seek(0)
-                    
-                    st.download_button(
-                        label="⬇️ 下載所有 QR Code (ZIP)",
-                        data=zip_buffer,
-                        file_name=f"qrcodes_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
-                        mime="application/zip"
-                    )
-                
-                # 顯示詳細結果
-                with st.expander("📋 查看詳細結果"):
+                # 建立 ZIP（PNG 本身已經過壓縮，不再壓縮）
+                zip_buffer = io.BytesIO()
+                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_STORED) as zip_file:
                     for file_result in all_results:
-                        st.markdown(f"### {file_result['filename']}")
                         for qr_result in file_result['results']:
-                            col1, col2 = st.columns([3, 1])
-                            with col1:
-                                st.text(f"QR #{qr_result['index']}: {qr_result['original']} → {qr_result['converted']}")
-                            with col2:
-                                # 轉換 PIL Image 為 bytes 以便顯示
-                                img_preview = io.BytesIO()
-                                qr_result['qr_image'].save(img_preview, format='PNG')
-                                img_preview.seek(0)
-                                st.image(img_preview, width=100)
+                            if len(file_result['results']) == 1:
+                                filename = f"{file_result['filename'].rsplit('.', 1)[0]}.png"
+                            else:
+                                filename = f"{file_result['filename'].rsplit('.', 1)[0]}_{qr_result['index']}.png"
+                            
+                            zip_file.writestr(filename, qr_result['png_bytes'])
+                
+                st.session_state['batch_result'] = {
+                    'key': batch_key,
+                    'all_results': all_results,
+                    'incomplete_files': incomplete_files,
+                    'zip_bytes': zip_buffer.getvalue(),
+                    'zip_name': f"qrcodes_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+                }
+            
+            batch_result = st.session_state.get('batch_result')
+            if batch_result and batch_result['key'] == batch_key:
+                show_batch_results(
+                    len(uploaded_files),
+                    batch_result['all_results'],
+                    batch_result['incomplete_files'],
+                    batch_result['zip_bytes'],
+                    batch_result['zip_name'],
+                )
     
     # 頁尾
     st.divider()